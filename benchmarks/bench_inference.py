@@ -0,0 +1,113 @@
+# Inference benchmark: load time (including the one-time export) and per-image and batched prediction latency
+# of the latest model on every CPU backend, on generated JPEGs or the images of a batch.
+#
+#   python benchmarks/bench_inference.py --backends pytorch,onnx,openvino --imgsz 640 --threads 4 --output inference.json
+
+import argparse
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from trainer import INFERENCE_BACKENDS, INFERENCE_IMGSZ, PREDICTION_BATCH_SIZE, find_latest_model, hash_file, load_config  # noqa: E402
+from trainer import load_inference_model, predict_boxes  # noqa: E402
+
+
+def make_images(directory, count, width, height):
+    from PIL import Image
+
+    paths = []
+    for index in range(count):
+        path = os.path.join(directory, f"img{index:05d}.jpg")
+        Image.effect_noise((width, height), 64).convert('RGB').save(path, quality=90)
+        paths.append(path)
+
+    return paths
+
+
+def summarize(times):
+    times = sorted(times)
+    return {
+        'p50_ms': times[len(times) // 2] * 1000,
+        'p95_ms': times[min(int(len(times) * 0.95), len(times) - 1)] * 1000,
+        'mean_ms': sum(times) / len(times) * 1000,
+    }
+
+
+def measure(model, images, repeats):
+    single = []
+    for _ in range(repeats):
+        for image in images:
+            started = time.perf_counter()
+            predict_boxes(model, [image])
+            single.append(time.perf_counter() - started)
+
+    batched = []
+    for _ in range(repeats):
+        for start in range(0, len(images), PREDICTION_BATCH_SIZE):
+            chunk = images[start:start + PREDICTION_BATCH_SIZE]
+            started = time.perf_counter()
+            predict_boxes(model, chunk)
+            batched.append((time.perf_counter() - started) / len(chunk))
+
+    return {'single': summarize(single), 'batched_per_image': summarize(batched)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure prediction latency of the model on every inference backend.")
+    parser.add_argument('--model', help="weights to benchmark, defaults to the latest model of the configured container")
+    parser.add_argument('--images', help="directory with the JPEGs to predict, generated when not given")
+    parser.add_argument('--count', type=int, default=16, help="number of generated images")
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--backends', default=','.join(INFERENCE_BACKENDS))
+    parser.add_argument('--imgsz', type=int, default=INFERENCE_IMGSZ)
+    parser.add_argument('--threads', type=int, default=0, help="0 for the runtime's default")
+    parser.add_argument('--precision', default='fp32', choices=['fp32', 'fp16'])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--data-dir', default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data'))
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    model_path = args.model
+    if model_path is None:
+        config = load_config(os.path.join(args.data_dir, 'config', 'config.yml'))
+        model_path = find_latest_model(os.path.join(args.data_dir, config['container'], 'models'))
+
+    if model_path is None:
+        print("No model found, pass --model")
+        sys.exit(1)
+
+    model_hash = hash_file(model_path)
+    results = {'model': os.path.basename(model_path), 'imgsz': args.imgsz, 'threads': args.threads, 'precision': args.precision, 'backends': {}}
+    with tempfile.TemporaryDirectory() as directory:
+        images = sorted(glob.glob(os.path.join(args.images, '*.jpg'))) if args.images else make_images(directory, args.count, args.width, args.height)
+        for backend in args.backends.split(','):
+            options = {'backend': backend, 'imgsz': args.imgsz, 'threads': args.threads, 'precision': args.precision}
+            started = time.perf_counter()
+            model = load_inference_model(model_path, model_hash, options)
+            load_s = time.perf_counter() - started
+            if model.backend != backend:
+                print(f"{backend}: not available, skipped")
+                results['backends'][backend] = None
+                continue
+
+            results['backends'][backend] = {'load_s': load_s, **measure(model, images, args.repeats)}
+
+    print()
+    for backend, result in results['backends'].items():
+        if result is not None:
+            print(f"{backend:10} load {result['load_s']:6.1f} s  single p50 {result['single']['p50_ms']:7.1f} ms  p95 {result['single']['p95_ms']:7.1f} ms"
+                  f"  batched {result['batched_per_image']['mean_ms']:7.1f} ms/image")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
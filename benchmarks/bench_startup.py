@@ -0,0 +1,126 @@
+# Startup benchmark: import time of src/trainer.py (parsed from -X importtime) and time-to-first-window.
+#
+#   python benchmarks/bench_startup.py --runs 5 --max-window-ms 1500 --output startup.json
+#
+# Exits with 1 when a --max-* budget is exceeded, so it can guard against import-time regressions.
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(REPO_DIR, 'src')
+TRAINER = os.path.join(SRC_DIR, 'trainer.py')
+
+# modules that must not be loaded before the window is shown
+HEAVY_MODULES = ['torch', 'ultralytics', 'requests', 'urllib3', 'PIL', 'tqdm', 'yaml', 'numpy', 'cv2']
+
+IMPORT_TIME_LINE = re.compile(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def parse_import_time(stderr):
+    imports = []
+    for line in stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            imports.append({'name': name, 'self_us': int(self_us), 'cumulative_us': int(cumulative_us), 'depth': (len(indent) - 1) // 2})
+
+    return imports
+
+
+def measure_import(module='trainer'):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=SRC_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr}")
+
+    imports = parse_import_time(result.stderr)
+    # children are listed before their parent, so everything trainer imported sits between it and the previous top-level line
+    end = max(index for index, entry in enumerate(imports) if entry['name'] == module and entry['depth'] == 0)
+    start = end
+    while start > 0 and imports[start - 1]['depth'] > 0:
+        start -= 1
+
+    children = imports[start:end]
+    loaded = {entry['name'].split('.')[0] for entry in children}
+    heavy = sorted(name for name in HEAVY_MODULES if name in loaded)
+    top_level = sorted((entry for entry in children if entry['depth'] == 1), key=lambda entry: entry['cumulative_us'], reverse=True)
+    return imports[end]['cumulative_us'] / 1000, heavy, top_level
+
+
+def measure_first_window(timeout=120):
+    with tempfile.TemporaryDirectory() as directory:
+        # a data dir of its own without url or code, the trainer neither syncs the real container nor writes next to its data
+        data_dir = os.path.join(directory, 'data')
+        os.makedirs(os.path.join(data_dir, 'config'))
+        with open(os.path.join(data_dir, 'config', 'config.yml'), 'w') as file:
+            file.write("container: bench\n")
+
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, TRAINER, '--startup-benchmark', '--data-dir', data_dir], cwd=REPO_DIR, stdout=subprocess.PIPE, text=True)
+        try:
+            for line in process.stdout:
+                if line.startswith('first window after'):
+                    return (time.perf_counter() - started) * 1000
+
+            raise RuntimeError("trainer exited without showing a window")
+        finally:
+            process.stdout.close()
+            process.wait(timeout=timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import time and time-to-first-window of the trainer.")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--skip-window', action='store_true', help="only measure imports, e.g. when there is no display")
+    parser.add_argument('--max-import-ms', type=float)
+    parser.add_argument('--max-window-ms', type=float)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    import_times = []
+    heavy, top_level = [], []
+    for _ in range(args.runs):
+        import_ms, heavy, top_level = measure_import()
+        import_times.append(import_ms)
+
+    results = {'import_ms': statistics.median(import_times), 'heavy_modules_at_import': heavy}
+    print(f"import trainer: {results['import_ms']:.1f} ms (median of {args.runs})")
+    for entry in top_level[:10]:
+        print(f"  {entry['cumulative_us'] / 1000:8.1f} ms  {entry['name']}")
+
+    if heavy:
+        print(f"heavy modules loaded at import: {', '.join(heavy)}")
+
+    if not args.skip_window:
+        window_times = [measure_first_window() for _ in range(args.runs)]
+        results['first_window_ms'] = statistics.median(window_times)
+        print(f"time to first window: {results['first_window_ms']:.0f} ms (median of {args.runs})")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    failed = False
+    if args.max_import_ms is not None and results['import_ms'] > args.max_import_ms:
+        print(f"import time {results['import_ms']:.1f} ms exceeds budget of {args.max_import_ms} ms")
+        failed = True
+
+    if args.max_window_ms is not None and results.get('first_window_ms', 0) > args.max_window_ms:
+        print(f"time to first window {results['first_window_ms']:.0f} ms exceeds budget of {args.max_window_ms} ms")
+        failed = True
+
+    if heavy:
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# Transfer benchmark against the local blob stand-in: listing, batch download (cold and as a no-op sync),
+# label upload and a block upload of one large file.
+#
+#   python benchmarks/bench_transfers.py --files 1000 --size-kb 300 --latency-ms 20 --bandwidth-mbps 200 --output transfers.json
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from blob_server import BlobStore, start_server
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from trainer import download_folder, list_blob_properties, list_folders_in_folder_azure, upload_file, upload_folder  # noqa: E402
+
+CONTAINER = 'bench'
+CODE = 'sv=local'
+BATCH = 'batches/bench'
+
+
+def seed_batch(store, files, size):
+    for index in range(files):
+        store.put(CONTAINER, f"{BATCH}/img{index:05d}.jpg", os.urandom(size))
+        store.put(CONTAINER, f"{BATCH}/labels/img{index:05d}.txt", b"0 0.5 0.5 0.25 0.25\n")
+
+
+def timed(action):
+    started = time.perf_counter()
+    result = action()
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure listing and transfer throughput against a local blob stand-in.")
+    parser.add_argument('--files', type=int, default=500, help="images in the benchmark batch, each with a label")
+    parser.add_argument('--size-kb', type=int, default=200, help="size of every image")
+    parser.add_argument('--large-mb', type=int, default=64, help="size of the file uploaded as a block list, 0 to skip")
+    parser.add_argument('--latency-ms', type=float, default=10)
+    parser.add_argument('--bandwidth-mbps', type=float, default=0, help="per request, 0 for unlimited")
+    parser.add_argument('--page-size', type=int, default=5000, help="entries per List Blobs page")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    store = BlobStore()
+    seed_batch(store, args.files, args.size_kb * 1024)
+    server, url = start_server(store, latency_ms=args.latency_ms, bandwidth_mbps=args.bandwidth_mbps, page_size=args.page_size)
+    results = {'files': args.files, 'size_kb': args.size_kb, 'latency_ms': args.latency_ms, 'bandwidth_mbps': args.bandwidth_mbps, 'concurrency': args.concurrency}
+
+    blobs, elapsed = timed(lambda: list(list_blob_properties(url, CONTAINER, CODE, BATCH)))
+    results['listing_s'] = elapsed
+    print(f"listing: {len(blobs)} blobs in {elapsed * 1000:.0f} ms")
+
+    _, elapsed = timed(lambda: list_folders_in_folder_azure(url, CONTAINER, CODE, 'batches'))
+    results['folder_listing_s'] = elapsed
+    print(f"folder listing: {elapsed * 1000:.0f} ms")
+
+    with tempfile.TemporaryDirectory() as local_directory:
+        stats, elapsed = timed(lambda: download_folder(url, CONTAINER, CODE, BATCH, local_directory, args.concurrency, True))
+        results['download'] = {'seconds': elapsed, 'files_per_s': stats.files / elapsed, 'mb_per_s': stats.bytes / elapsed / 1e6, 'failed': stats.failed}
+
+        stats, elapsed = timed(lambda: download_folder(url, CONTAINER, CODE, BATCH, local_directory, args.concurrency, True))
+        results['sync_up_to_date_s'] = elapsed
+
+        labels_dir = os.path.join(local_directory, BATCH, 'labels')
+        stats, elapsed = timed(lambda: upload_folder(labels_dir, url, CONTAINER, CODE, f"{BATCH}/labels", args.concurrency))
+        results['label_upload'] = {'seconds': elapsed, 'files_per_s': stats.files / elapsed, 'failed': stats.failed}
+
+        if args.large_mb:
+            large_path = os.path.join(local_directory, 'large.bin')
+            with open(large_path, 'wb') as file:
+                file.write(os.urandom(args.large_mb * 1024 * 1024))
+
+            size, elapsed = timed(lambda: upload_file(large_path, url, CONTAINER, CODE, 'models/large.bin', True))
+            results['block_upload'] = {'seconds': elapsed, 'mb_per_s': (size or 0) / elapsed / 1e6, 'failed': size is None}
+
+    server.shutdown()
+
+    print()
+    print(f"download:       {results['download']['files_per_s']:8.1f} files/s {results['download']['mb_per_s']:8.2f} MB/s")
+    print(f"no-op sync:     {results['sync_up_to_date_s'] * 1000:8.0f} ms")
+    print(f"label upload:   {results['label_upload']['files_per_s']:8.1f} files/s")
+    if 'block_upload' in results:
+        print(f"block upload:   {results['block_upload']['mb_per_s']:8.2f} MB/s")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
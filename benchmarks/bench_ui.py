@@ -0,0 +1,166 @@
+# UI benchmark: load_image latency, cold and with prefetching at an annotator's pace, and box render latency
+# at 10/100/1000 boxes, on generated JPEGs in a temporary batch. Needs a display.
+#
+#   python benchmarks/bench_ui.py --images 30 --width 1920 --height 1080 --output ui.json
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from trainer import LabelTool, format_label_line  # noqa: E402
+
+BOX_COUNTS = [10, 100, 1000]
+
+
+def write_label(labels_dir, name, count):
+    lines = []
+    for _ in range(count):
+        x1, y1 = random.uniform(0, 0.9), random.uniform(0, 0.9)
+        lines.append(format_label_line(0, x1, y1, x1 + random.uniform(0.01, 0.1), y1 + random.uniform(0.01, 0.1)))
+
+    with open(os.path.join(labels_dir, f"{name}.txt"), 'w') as file:
+        file.write(''.join(lines))
+
+
+def make_batch(batch_dir, images, width, height, boxes):
+    from PIL import Image
+
+    labels_dir = os.path.join(batch_dir, 'labels')
+    os.makedirs(labels_dir)
+    # noise doesn't compress, so decoding costs about what a real photo of that size does
+    first = os.path.join(batch_dir, 'img00000.jpg')
+    Image.effect_noise((width, height), 64).convert('RGB').save(first, quality=90)
+    for index in range(images):
+        name = f"img{index:05d}"
+        if index:
+            shutil.copyfile(first, os.path.join(batch_dir, f"{name}.jpg"))
+
+        write_label(labels_dir, name, boxes)
+
+
+def summarize(times):
+    times = sorted(times)
+    return {
+        'p50_ms': times[len(times) // 2] * 1000,
+        'p95_ms': times[min(int(len(times) * 0.95), len(times) - 1)] * 1000,
+        'mean_ms': sum(times) / len(times) * 1000,
+    }
+
+
+def pump(root, milliseconds):
+    # lets the prefetcher and the ui queue run as they would while the annotator looks at the image
+    end = time.perf_counter() + milliseconds / 1000
+    while time.perf_counter() < end:
+        root.update()
+        time.sleep(0.002)
+
+
+def measure_loads(tool, root, count, think_ms, cold):
+    times = []
+    for index in range(1, count + 1):
+        if cold:
+            tool.prefetcher.clear()
+            pump(root, 0)
+
+        tool.cur = index
+        started = time.perf_counter()
+        tool.load_image()
+        root.update_idletasks()
+        times.append(time.perf_counter() - started)
+        if not cold:
+            pump(root, think_ms)
+
+    return times
+
+
+def measure_boxes(tool, root, labels_dir, count, repeats):
+    write_label(labels_dir, tool.imageList[0], count)
+    tool.cur = 1
+    tool.load_image()
+    root.update_idletasks()
+
+    load_times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        tool.load_image()
+        root.update_idletasks()
+        load_times.append(time.perf_counter() - started)
+
+    select_times = []
+    for index in range(repeats):
+        started = time.perf_counter()
+        tool.select_box(index % count)
+        root.update_idletasks()
+        select_times.append(time.perf_counter() - started)
+
+    return {'load': summarize(load_times), 'select': summarize(select_times), 'canvas_items': tool.canvas_item_count()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure image load and box render latency of the labeling window.")
+    parser.add_argument('--images', type=int, default=30)
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--boxes', type=int, default=5, help="boxes per image for the load benchmark")
+    parser.add_argument('--think-ms', type=float, default=300, help="time spent on every image when prefetching")
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    from tkinter import Tk, TclError
+
+    try:
+        root = Tk()
+    except TclError as error:
+        print(f"No display, skipping the UI benchmark: {error}")
+        sys.exit(0)
+
+    results = {'images': args.images, 'width': args.width, 'height': args.height}
+    with tempfile.TemporaryDirectory() as directory:
+        # a data dir of its own without url or code, the tool neither syncs the real container nor writes next to its data
+        data_dir = os.path.join(directory, 'data')
+        os.makedirs(os.path.join(data_dir, 'config'))
+        with open(os.path.join(data_dir, 'config', 'config.yml'), 'w') as file:
+            file.write("container: bench\n")
+
+        batch_dir = os.path.join(data_dir, 'bench', 'batches', 'bench')
+        make_batch(batch_dir, args.images, args.width, args.height, args.boxes)
+
+        # load_image logs every box to the console, which is not what is measured here
+        with contextlib.redirect_stdout(io.StringIO()):
+            tool = LabelTool(root, data_dir)
+            pump(root, 500)
+            tool.unload()
+            tool.load_dir(batch_dir)
+            root.update()
+
+            results['load_cold'] = summarize(measure_loads(tool, root, args.images, args.think_ms, True))
+            results['load_prefetched'] = summarize(measure_loads(tool, root, args.images, args.think_ms, False))
+            results['boxes'] = {count: measure_boxes(tool, root, os.path.join(batch_dir, 'labels'), count, args.repeats) for count in BOX_COUNTS}
+
+            tool.unload()
+
+    root.destroy()
+
+    for key in ('load_cold', 'load_prefetched'):
+        print(f"{key:16} p50 {results[key]['p50_ms']:7.1f} ms  p95 {results[key]['p95_ms']:7.1f} ms")
+
+    for count, boxes in results['boxes'].items():
+        print(f"{count:5} boxes      load p50 {boxes['load']['p50_ms']:7.1f} ms  select p50 {boxes['select']['p50_ms']:6.2f} ms  ({boxes['canvas_items']} canvas items)")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
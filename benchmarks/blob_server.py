@@ -0,0 +1,313 @@
+# Local stand-in for the part of the Azure Blob REST API the trainer uses: List Blobs (prefix, delimiter, marker),
+# Get Blob (with Range and If-Match), Get Blob Properties (HEAD), Put Blob, Put Block and Put Block List.
+# Blobs live in memory, latency, bandwidth and transient failures can be injected.
+#
+#   python benchmarks/blob_server.py --port 10000 --seed data/mycontainer --latency-ms 20 --bandwidth-mbps 100
+#
+# then point the trainer at it with the code http://127.0.0.1:10000/mycontainer?sv=local
+
+import argparse
+import base64
+import hashlib
+import itertools
+import os
+import random
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+CHUNK_SIZE = 64 * 1024
+DEFAULT_PAGE_SIZE = 5000
+
+
+class BlobStore:
+    def __init__(self):
+        self.containers = {}
+        self.blocks = {}
+        self.etags = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def put(self, container, name, data, content_md5=None):
+        blob = {
+            'data': data,
+            'etag': f"0x{next(self.etags):016X}",
+            'last_modified': formatdate(usegmt=True),
+            'content_md5': content_md5,
+        }
+        with self.lock:
+            self.containers.setdefault(container, {})[name] = blob
+
+        return blob
+
+    def get(self, container, name):
+        with self.lock:
+            return self.containers.get(container, {}).get(name)
+
+    def put_block(self, container, name, block_id, data):
+        with self.lock:
+            self.blocks.setdefault((container, name), {})[block_id] = data
+
+    def commit_blocks(self, container, name, block_ids):
+        with self.lock:
+            blocks = self.blocks.pop((container, name), {})
+
+        missing = [block_id for block_id in block_ids if block_id not in blocks]
+        if missing:
+            return None
+
+        return self.put(container, name, b''.join(blocks[block_id] for block_id in block_ids))
+
+    def list(self, container, prefix, delimiter, marker, page_size):
+        # blobs and virtual folders share one name ordered listing, a page ends after page_size entries
+        with self.lock:
+            if container not in self.containers:
+                return None
+
+            blobs = sorted(self.containers[container].items())
+
+        entries = []
+        seen_prefixes = set()
+        for name, blob in blobs:
+            if not name.startswith(prefix):
+                continue
+
+            remainder = name[len(prefix):]
+            if delimiter and delimiter in remainder:
+                folder = prefix + remainder.split(delimiter)[0] + delimiter
+                if folder not in seen_prefixes:
+                    seen_prefixes.add(folder)
+                    entries.append((folder, None))
+            else:
+                entries.append((name, blob))
+
+        entries = [entry for entry in entries if entry[0] >= marker]
+        next_marker = entries[page_size][0] if len(entries) > page_size else ''
+        return entries[:page_size], next_marker
+
+    def seed(self, container, directory):
+        for base, _, file_names in os.walk(directory):
+            for file_name in file_names:
+                file_path = os.path.join(base, file_name)
+                name = os.path.relpath(file_path, directory).replace('\\', '/')
+                if name.startswith('.'):
+                    continue
+
+                with open(file_path, 'rb') as file:
+                    data = file.read()
+
+                self.put(container, name, data, base64.b64encode(hashlib.md5(data).digest()).decode('ascii'))
+
+
+def format_listing(container, prefix, delimiter, marker, entries, next_marker):
+    parts = [f'<?xml version="1.0" encoding="utf-8"?><EnumerationResults ContainerName="{escape(container)}">']
+    parts.append(f"<Prefix>{escape(prefix)}</Prefix><Marker>{escape(marker)}</Marker><Delimiter>{escape(delimiter)}</Delimiter><Blobs>")
+    for name, blob in entries:
+        if blob is None:
+            parts.append(f"<BlobPrefix><Name>{escape(name)}</Name></BlobPrefix>")
+            continue
+
+        content_md5 = f"<Content-MD5>{blob['content_md5']}</Content-MD5>" if blob['content_md5'] else "<Content-MD5 />"
+        parts.append(
+            f"<Blob><Name>{escape(name)}</Name><Properties><Last-Modified>{blob['last_modified']}</Last-Modified>"
+            f"<Etag>{blob['etag']}</Etag><Content-Length>{len(blob['data'])}</Content-Length>"
+            f"<Content-Type>application/octet-stream</Content-Type>{content_md5}<BlobType>BlockBlob</BlobType></Properties></Blob>"
+        )
+
+    parts.append(f"</Blobs><NextMarker>{escape(next_marker)}</NextMarker></EnumerationResults>")
+    return ''.join(parts).encode('utf-8')
+
+
+class BlobRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def parse(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query, keep_blank_values=True).items()}
+        parts = unquote(url.path).lstrip('/').split('/', 1)
+        return parts[0], parts[1] if len(parts) > 1 else '', query
+
+    def inject(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if self.server.failRate and random.random() < self.server.failRate:
+            self.read_body()
+            self.reply(503, b'ServerBusy')
+            return True
+
+        return False
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        data = bytearray()
+        started = time.perf_counter()
+        while len(data) < length:
+            chunk = self.rfile.read(min(CHUNK_SIZE, length - len(data)))
+            if not chunk:
+                break
+
+            data += chunk
+            self.throttle(len(data), started)
+
+        return bytes(data)
+
+    def throttle(self, sent, started):
+        if self.server.bandwidth:
+            delay = sent / self.server.bandwidth - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+
+    def reply(self, status, body=b'', headers=None, send_body=True):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not send_body:
+            return
+
+        started = time.perf_counter()
+        for offset in range(0, len(body), CHUNK_SIZE):
+            self.wfile.write(body[offset:offset + CHUNK_SIZE])
+            self.throttle(offset + CHUNK_SIZE, started)
+
+    def blob_headers(self, blob):
+        headers = {'ETag': f'"{blob["etag"]}"', 'Last-Modified': blob['last_modified'], 'Accept-Ranges': 'bytes', 'x-ms-blob-type': 'BlockBlob'}
+        if blob['content_md5']:
+            headers['Content-MD5'] = blob['content_md5']
+
+        return headers
+
+    def do_GET(self):
+        self.get_or_head(True)
+
+    def do_HEAD(self):
+        self.get_or_head(False)
+
+    def get_or_head(self, send_body):
+        if self.inject():
+            return
+
+        container, name, query = self.parse()
+        if query.get('comp') == 'list':
+            listing = self.server.store.list(container, query.get('prefix', ''), query.get('delimiter', ''), query.get('marker', ''), int(query.get('maxresults') or self.server.pageSize))
+            if listing is None:
+                self.reply(404, b'ContainerNotFound', send_body=send_body)
+                return
+
+            body = format_listing(container, query.get('prefix', ''), query.get('delimiter', ''), query.get('marker', ''), *listing)
+            self.reply(200, body, {'Content-Type': 'application/xml'}, send_body)
+            return
+
+        blob = self.server.store.get(container, name)
+        if blob is None:
+            self.reply(404, b'BlobNotFound', send_body=send_body)
+            return
+
+        if_match = self.headers.get('If-Match')
+        if if_match and if_match != '*' and if_match.strip('"') != blob['etag']:
+            self.reply(412, b'ConditionNotMet', send_body=send_body)
+            return
+
+        data = blob['data']
+        headers = self.blob_headers(blob)
+        byte_range = self.headers.get('Range') or self.headers.get('x-ms-range')
+        if byte_range and byte_range.startswith('bytes='):
+            start, _, end = byte_range[len('bytes='):].partition('-')
+            start = int(start)
+            end = min(int(end), len(data) - 1) if end else len(data) - 1
+            if start >= len(data):
+                self.reply(416, b'InvalidRange', {'Content-Range': f"bytes */{len(data)}"}, send_body)
+                return
+
+            headers['Content-Range'] = f"bytes {start}-{end}/{len(data)}"
+            self.reply(206, data[start:end + 1], headers, send_body)
+            return
+
+        self.reply(200, data, headers, send_body)
+
+    def do_PUT(self):
+        if self.inject():
+            return
+
+        container, name, query = self.parse()
+        body = self.read_body()
+        store = self.server.store
+        if query.get('restype') == 'container':
+            with store.lock:
+                store.containers.setdefault(container, {})
+
+            self.reply(201)
+            return
+
+        if query.get('comp') == 'block':
+            store.put_block(container, name, query.get('blockid', ''), body)
+            self.reply(201)
+            return
+
+        if query.get('comp') == 'blocklist':
+            block_ids = [element.text for element in ElementTree.fromstring(body) if element.text]
+            blob = store.commit_blocks(container, name, block_ids)
+            if blob is None:
+                self.reply(400, b'InvalidBlockList')
+                return
+
+            self.reply(201, headers={'ETag': f'"{blob["etag"]}"'})
+            return
+
+        blob = store.put(container, name, body, base64.b64encode(hashlib.md5(body).digest()).decode('ascii'))
+        self.reply(201, headers=self.blob_headers(blob))
+
+
+def start_server(store=None, host='127.0.0.1', port=0, latency_ms=0, bandwidth_mbps=0, fail_rate=0, page_size=DEFAULT_PAGE_SIZE, verbose=False):
+    # returns the running server and the url to use as the trainer's url
+    server = ThreadingHTTPServer((host, port), BlobRequestHandler)
+    server.daemon_threads = True
+    server.store = store or BlobStore()
+    server.latency = latency_ms / 1000
+    server.bandwidth = bandwidth_mbps * 1e6 / 8
+    server.failRate = fail_rate
+    server.pageSize = page_size
+    server.verbose = verbose
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve an in-memory stand-in for Azure Blob storage.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=10000)
+    parser.add_argument('--container', default='local')
+    parser.add_argument('--seed', help="directory whose files are loaded into the container")
+    parser.add_argument('--latency-ms', type=float, default=0, help="added to every request")
+    parser.add_argument('--bandwidth-mbps', type=float, default=0, help="per request, 0 for unlimited")
+    parser.add_argument('--fail-rate', type=float, default=0, help="fraction of requests answered with 503")
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE, help="entries per List Blobs page")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    store = BlobStore()
+    store.containers[args.container] = {}
+    if args.seed:
+        store.seed(args.container, args.seed)
+
+    server, url = start_server(store, args.host, args.port, args.latency_ms, args.bandwidth_mbps, args.fail_rate, args.page_size, args.verbose)
+    print(f"Serving {len(store.containers[args.container])} blobs, code: {url}{args.container}?sv=local")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+import argparse
+import os
+import sys
+
+from trainer import DiskCache, load_config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show what the batches and models of the container take on disk and evict the least recently used.")
+    parser.add_argument('--evict', action='store_true', help="evict the least recently used batches and models until the cache fits the budget")
+    parser.add_argument('--budget-gb', type=float, help="budget to evict to, defaults to cache_budget_gb of the config")
+    parser.add_argument('--dry-run', action='store_true', help="with --evict, only list what would be evicted")
+    parser.add_argument('--data-dir', default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data'))
+    args = parser.parse_args()
+
+    config = load_config(os.path.join(args.data_dir, 'config', 'config.yml'))
+    disk_cache = DiskCache(os.path.join(args.data_dir, config['container']))
+    budget = (config['cache_budget_gb'] if args.budget_gb is None else args.budget_gb) * 1e9
+    print(disk_cache.report(budget))
+
+    if args.evict:
+        if not budget:
+            print("No budget set, pass --budget-gb or set cache_budget_gb in the config")
+            return 1
+
+        evicted, total = disk_cache.evict(budget, dry_run=args.dry_run)
+        for entry in evicted:
+            print(f"{'Would evict' if args.dry_run else 'Evicted'} {entry['key']} ({entry['size'] / 1e6:.1f} MB)")
+
+        print(f"{len(evicted)} entries, {total / 1e9:.2f} GB left in the cache")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
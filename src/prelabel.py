@@ -0,0 +1,151 @@
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from trainer import INFERENCE_BACKENDS, LABEL_ARCHIVE_NAME, LabelSyncState, download_folder, find_latest_model, get_inference_options, hash_file
+from trainer import load_classes_from_file, load_config, load_inference_model, predict_boxes, predictions_to_label_lines, upload_archive, upload_folder
+from trainer import write_file_atomic
+
+# images handed to a worker at once, each worker runs them as one batched YOLO call
+PRELABEL_BATCH_SIZE = 16
+
+# the model of this worker process, loaded once by init_worker
+_worker = {}
+
+
+def init_worker(model_path, model_hash, model_dir, options):
+    prediction_classes = load_classes_from_file(model_dir, 'az_trainer_prediction')
+    classes = load_classes_from_file(model_dir, 'names')
+    # the main process already picked the backend and exported the weights for it
+    _worker['model'] = load_inference_model(model_path, model_hash, options)
+    _worker['prediction_classes'] = prediction_classes
+    _worker['class_indexes'] = {class_name: class_id for class_id, class_name in classes.items()}
+
+
+def label_images(image_paths, labels_dir):
+    predictions = predict_boxes(_worker['model'], image_paths)
+    for image_path, boxes in zip(image_paths, predictions):
+        lines = predictions_to_label_lines(boxes, _worker['prediction_classes'], _worker['class_indexes'])
+        label_name = f"{os.path.splitext(os.path.basename(image_path))[0]}.txt"
+        # written atomically, so an interrupted run never leaves a label file that would be skipped on resume
+        write_file_atomic(os.path.join(labels_dir, label_name), ''.join(lines))
+
+    return len(image_paths)
+
+
+def find_unlabeled_images(batch_dir, labels_dir, overwrite):
+    images = sorted(glob.glob(os.path.join(batch_dir, '*.jpg')))
+    if overwrite:
+        return images, 0
+
+    unlabeled = [image for image in images if not os.path.exists(os.path.join(labels_dir, f"{os.path.splitext(os.path.basename(image))[0]}.txt"))]
+    return unlabeled, len(images) - len(unlabeled)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-label a batch with the latest model, without a display.")
+    parser.add_argument('batch', help="name of the batch under batches/")
+    parser.add_argument('--workers', type=int, default=max((os.cpu_count() or 2) // 2, 1), help="number of worker processes, each holding one model")
+    parser.add_argument('--batch-size', type=int, default=PRELABEL_BATCH_SIZE, help="images per YOLO call")
+    parser.add_argument('--no-download', action='store_true', help="use the models and images already on disk")
+    parser.add_argument('--backend', choices=['auto'] + INFERENCE_BACKENDS, help="inference runtime, defaults to inference_backend of the config")
+    parser.add_argument('--overwrite', action='store_true', help="also re-label images that already have a label file")
+    parser.add_argument('--upload', action='store_true', help="upload the changed labels when done")
+    parser.add_argument('--archive', action='store_true', help=f"with --upload, upload all labels as one {LABEL_ARCHIVE_NAME} blob")
+    parser.add_argument('--data-dir', default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data'))
+    args = parser.parse_args()
+
+    config = load_config(os.path.join(args.data_dir, 'config', 'config.yml'))
+    container_dir = os.path.join(args.data_dir, config['container'])
+    model_dir = os.path.join(container_dir, 'models')
+    batch_dir = os.path.join(container_dir, 'batches', args.batch)
+    labels_dir = os.path.join(batch_dir, 'labels')
+
+    if not args.no_download:
+        stats = download_folder(config['url'], config['container'], config['code'], 'models', container_dir, config['transfer_concurrency'], True)
+        if stats and stats.listingError:
+            print("The model listing is incomplete, the latest model on disk may not be the latest one")
+
+        stats = download_folder(config['url'], config['container'], config['code'], f"batches/{args.batch}", container_dir, config['transfer_concurrency'], True)
+        if stats and stats.listingError:
+            # labels the listing didn't reach would be predicted over and uploaded on top of the server copies
+            print(f"The listing of batch {args.batch} is incomplete, not pre-labeling it")
+            return 1
+
+        # labels pulled from the server are in sync with it, --upload must not push them back as changed
+        labels_prefix = f"batches/{args.batch}/labels/"
+        downloaded_labels = [name[len(labels_prefix):] for name in stats.completed if name.startswith(labels_prefix)] if stats else []
+        if downloaded_labels:
+            LabelSyncState(batch_dir).mark_downloaded(downloaded_labels)
+
+    model_path = find_latest_model(model_dir)
+    if model_path is None:
+        print(f"No model found in {model_dir}")
+        return 1
+
+    if not os.path.isdir(batch_dir):
+        print(f"Batch not found: {batch_dir}")
+        return 1
+
+    os.makedirs(labels_dir, exist_ok=True)
+    images, skipped = find_unlabeled_images(batch_dir, labels_dir, args.overwrite)
+    print(f"Pre-labeling {len(images)} images of batch {args.batch} with {os.path.basename(model_path)}, {skipped} already labeled")
+
+    workers = max(min(args.workers, len(images)), 1)
+    threads = max((os.cpu_count() or 1) // workers, 1)
+    batch_size = max(args.batch_size, 1)
+    labeled = 0
+    started = time.perf_counter()
+
+    if images:
+        from tqdm import tqdm
+
+        # keep workers from oversubscribing the cores between them
+        options = get_inference_options(config)
+        options['threads'] = threads
+        if args.backend:
+            options['backend'] = args.backend
+
+        # exported once here, so the workers neither race on the export nor fall back one by one
+        model_hash = hash_file(model_path)
+        options['backend'] = load_inference_model(model_path, model_hash, options).backend
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(model_path, model_hash, model_dir, options)) as executor:
+            futures = [executor.submit(label_images, images[start:start + batch_size], labels_dir) for start in range(0, len(images), batch_size)]
+            with tqdm(total=len(images), desc="Pre-labeling", unit="image") as progress:
+                for future in as_completed(futures):
+                    count = future.result()
+                    labeled += count
+                    progress.set_postfix_str(f"{labeled / max(time.perf_counter() - started, 1e-6):.1f} images/s", refresh=False)
+                    progress.update(count)
+
+    elapsed = max(time.perf_counter() - started, 1e-6)
+    print(f"Pre-labeled {labeled} images in {elapsed:.1f}s ({labeled / elapsed:.1f} images/s) with {workers} workers, {skipped} skipped")
+
+    if args.upload:
+        label_sync = LabelSyncState(batch_dir)
+        dirty, unchanged = label_sync.dirty_files()
+        uploaded = 0
+        if dirty and args.archive:
+            hashes = {name: label_sync.current_hash(name) for name in os.listdir(labels_dir) if name.endswith('.txt')}
+            stats = upload_archive(labels_dir, config['url'], config['container'], config['code'], f"batches/{args.batch}/{LABEL_ARCHIVE_NAME}", sorted(hashes), 'labels/')
+            if stats:
+                label_sync.mark_uploaded({name: hashes[name] for name in stats.completed})
+                uploaded = stats.files
+                unchanged = 0
+        elif dirty:
+            stats = upload_folder(labels_dir, config['url'], config['container'], config['code'], f"batches/{args.batch}/labels", config['transfer_concurrency'], list(dirty))
+            if stats:
+                label_sync.mark_uploaded({name: dirty[name] for name in stats.completed})
+                uploaded = stats.files
+
+        print(f"Uploaded {uploaded} label files, skipped {unchanged} unchanged")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,28 +1,466 @@
-import ast
+import base64
+import csv
+import functools
+import hashlib
+import heapq
+import itertools
+import json
 import pathlib
+import queue
+import random
 import re
+import shutil
+import sqlite3
+import sys
+import tempfile
 import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from datetime import datetime
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote
 from tkinter import END, LEFT, N, S, W, E, StringVar, Tk
 from tkinter import Button, Canvas, Entry, Frame, Label, Listbox, Toplevel
 from tkinter import messagebox
 from tkinter import ttk
 from xml.etree import ElementTree
 
-import requests
-import yaml
-from PIL import Image, ImageTk
 import os
 import glob
 
-from tqdm import tqdm
-from ultralytics import YOLO
+# requests, yaml, PIL, tqdm and ultralytics (which pulls in torch) are imported where they are first used,
+# so the window is up before the network and ML stacks are loaded
+
+PROCESS_STARTED = time.perf_counter()
 
 # colors for the bboxes
 COLORS = ['red', 'blue', 'green', 'black', 'cyan', 'pink', 'darkgreen', 'cyan', 'darkblue']
 # image sizes for the examples
 SIZE = 256, 256
 ZOOM_RATIO = 2
+# number of parallel blob transfers
+TRANSFER_CONCURRENCY = 16
+# files larger than one block are uploaded as a block list, block by block
+BLOCK_SIZE = 4 * 1024 * 1024
+BLOCK_CONCURRENCY = 4
+# tar archives directly under a downloaded folder that are extracted in place instead of being stored,
+# e.g. batches/<name>/shard-000.tar, the label archive upload uses the same naming
+ARCHIVE_PATTERN = re.compile(r'^shard-[\w.-]*?\.(tar|tar\.gz|tgz)$')
+LABEL_ARCHIVE_NAME = 'shard-labels.tar.gz'
+EXPORT_NAME_PATTERN = re.compile(r'^(?P<stem>.+)\.(?P<hash>[0-9a-f]{12})-\d+-(fp32|fp16)(\.onnx|_openvino_model)$')
+TRANSFER_RETRIES = 4
+# connect and read timeouts of a download, a stalled connection is retried instead of hanging the worker
+DOWNLOAD_TIMEOUT = (10, 60)
+# images per YOLO call when pre-annotating a batch in the background
+PREDICTION_BATCH_SIZE = 8
+# images decoded ahead of the annotator in each direction, and the memory the decoded frames may take
+PREFETCH_RADIUS = 3
+PREFETCH_CACHE_BYTES = 256 * 1024 * 1024
+# images fetched ahead of the annotator when a batch is streamed, and how many are fetched in parallel
+STREAM_LOOKAHEAD = 16
+STREAM_CONCURRENCY = 4
+# pointer motion is drawn at most once per display refresh
+POINTER_REFRESH_MS = 16
+# how often the Tk thread picks up results of background jobs
+UI_POLL_MS = 50
+# constructed models kept in memory, keyed by the content hash of their weights
+MODEL_CACHE_SIZE = 3
+# runtimes tried in this order when inference_backend is auto, the weights are exported to them once per hash,
+# PyTorch is always the fallback
+INFERENCE_BACKENDS = ['openvino', 'onnx', 'pytorch']
+INFERENCE_BACKEND_MODULES = {'openvino': 'openvino', 'onnx': 'onnxruntime', 'pytorch': 'torch'}
+INFERENCE_IMGSZ = 640
+# spans per name behind the rolling p50/p95, and spans kept for the session export
+TIMING_WINDOW = 200
+TIMING_RECORDS_MAX = 100000
+# transfer jobs with a lower number run first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+# how often the transfer panel is redrawn, and the image list of a downloading batch refreshed
+TRANSFER_PANEL_MS = 250
+# how often the timings window is redrawn
+TIMINGS_REFRESH_MS = 1000
+# label edits settle this long before the file is written, navigating on doesn't wait for the disk
+LABEL_WRITE_DELAY_MS = 500
+
+
+class Span:
+    __slots__ = ('timings', 'name', 'started')
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings.record(self.name, time.perf_counter() - self.started)
+
+
+class Timings:
+    # named spans of the hot paths, while disabled span() hands out one shared no-op context manager
+    def __init__(self, window=TIMING_WINDOW, max_records=TIMING_RECORDS_MAX):
+        self.enabled = False
+        self.window = window
+        self.maxRecords = max_records
+        self.sessionStarted = time.time()
+        self.started = time.perf_counter()
+        self.recent = {}
+        self.records = []
+        self.lock = threading.Lock()
+
+    def span(self, name):
+        return Span(self, name) if self.enabled else _no_span
+
+    def record(self, name, seconds):
+        with self.lock:
+            recent = self.recent.get(name)
+            if recent is None:
+                recent = self.recent[name] = deque(maxlen=self.window)
+
+            recent.append(seconds)
+            if len(self.records) < self.maxRecords:
+                self.records.append((time.perf_counter() - self.started, name, seconds, threading.current_thread().name))
+
+    def summary(self):
+        # name -> count, p50, p95 and max in ms over the last window spans
+        with self.lock:
+            recent = {name: sorted(values) for name, values in self.recent.items()}
+
+        summary = {}
+        for name, values in sorted(recent.items()):
+            summary[name] = {
+                'count': len(values),
+                'p50_ms': values[len(values) // 2] * 1000,
+                'p95_ms': values[min(int(len(values) * 0.95), len(values) - 1)] * 1000,
+                'max_ms': values[-1] * 1000,
+            }
+
+        return summary
+
+    def summary_string(self):
+        lines = [f"{'span':24} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}"]
+        for name, entry in self.summary().items():
+            lines.append(f"{name:24} {entry['count']:5} {entry['p50_ms']:9.2f} {entry['p95_ms']:9.2f} {entry['max_ms']:9.2f}")
+
+        return '\n'.join(lines)
+
+    def export(self, directory):
+        # one JSON and one CSV file per session, rewritten on every export
+        with self.lock:
+            records = list(self.records)
+
+        if not records:
+            return None
+
+        os.makedirs(directory, exist_ok=True)
+        base_path = os.path.join(directory, f"session-{datetime.fromtimestamp(self.sessionStarted).strftime('%Y%m%d-%H%M%S')}")
+        spans = [{'at_s': at, 'name': name, 'ms': seconds * 1000, 'thread': thread} for at, name, seconds, thread in records]
+        with open(f"{base_path}.json", 'w') as file:
+            json.dump({'session_started': self.sessionStarted, 'summary': self.summary(), 'spans': spans}, file, indent=1)
+
+        with open(f"{base_path}.csv", 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['at_s', 'name', 'ms', 'thread'])
+            for span in spans:
+                writer.writerow([f"{span['at_s']:.6f}", span['name'], f"{span['ms']:.3f}", span['thread']])
+
+        return base_path
+
+
+_no_span = nullcontext()
+# enabled with --timings, AZ_TRAINER_TIMINGS=1 or from the timings window
+timings = Timings()
+
+
+def timed(name):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not timings.enabled:
+                return function(*args, **kwargs)
+
+            with Span(timings, name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+_session = None
+_session_pool_size = 0
+_session_lock = threading.Lock()
+
+
+def get_session(pool_size=TRANSFER_CONCURRENCY):
+    # shared session so that every transfer reuses pooled keep-alive connections instead of a new TCP+TLS handshake
+    global _session, _session_pool_size
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+
+        if pool_size > _session_pool_size:
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+            _session_pool_size = pool_size
+
+        return _session
+
+
+def describe_error(error):
+    # requests puts the url into its messages, the SAS code in its query must not end up in the console
+    return re.sub(r'\?\S*', '', str(error))
+
+
+class BlobIntegrityError(Exception):
+    # a downloaded blob whose length or MD5 doesn't match the server, worth another attempt
+    pass
+
+
+def is_retryable(error):
+    import requests
+    import urllib3
+
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status >= 500 or status in (408, 429)
+
+    # a listing page cut off while it streams in surfaces from urllib3 or the XML parser
+    retryable = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError, ConnectionError, TimeoutError, BlobIntegrityError,
+                 urllib3.exceptions.ProtocolError, urllib3.exceptions.ReadTimeoutError, ElementTree.ParseError)
+    return isinstance(error, retryable)
+
+
+def get_retry_delay(attempt, backoff=0.5):
+    # exponential backoff with jitter, so parallel workers don't retry in lockstep
+    return backoff * (2 ** attempt) * (0.5 + random.random())
+
+
+def with_retries(action, attempts=TRANSFER_RETRIES, backoff=0.5):
+    for attempt in range(attempts):
+        try:
+            return action()
+        except Exception as error:
+            if attempt == attempts - 1 or not is_retryable(error):
+                raise
+
+            time.sleep(get_retry_delay(attempt, backoff))
+
+
+class TransferStats:
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.failed = 0
+        self.skipped = 0
+        self.completed = []
+        self.failures = []
+        # set when the listing broke off, the blobs it didn't reach were never tried
+        self.listingError = None
+        # a download's listing went through, and the blobs it still has to fetch
+        self.listingDone = False
+        self.pending = set()
+        # what the transfer is known to cover so far, grows while the listing streams in
+        self.totalFiles = 0
+        self.totalBytes = 0
+        self.started = time.perf_counter()
+        self.finished = None
+        self.lock = threading.Lock()
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    def expect(self, size, name=None):
+        with self.lock:
+            self.totalFiles += 1
+            self.totalBytes += size or 0
+            if name is not None:
+                self.pending.add(name)
+
+    def keep(self, name, size):
+        # an expected blob that was left alone after all, the local file wins
+        with self.lock:
+            self.totalFiles -= 1
+            self.totalBytes -= size or 0
+            self.skipped += 1
+            self.pending.discard(name)
+
+    def add_completed(self, names):
+        with self.lock:
+            self.completed.extend(names)
+
+    def add(self, size, name=None, error=None):
+        with self.lock:
+            self.pending.discard(name)
+            if size is None:
+                self.failed += 1
+                if name is not None:
+                    self.failures.append((name, describe_error(error) if error is not None else 'failed'))
+            else:
+                self.files += 1
+                self.bytes += size
+                if name is not None:
+                    self.completed.append(name)
+
+    def elapsed(self):
+        return max((self.finished or time.perf_counter()) - self.started, 1e-6)
+
+    def rate(self):
+        elapsed = self.elapsed()
+        return self.files / elapsed, self.bytes / elapsed / 1e6
+
+    def rate_string(self):
+        files_per_second, mb_per_second = self.rate()
+        return f"{files_per_second:.1f} files/s, {mb_per_second:.2f} MB/s"
+
+    def fraction(self):
+        if self.totalBytes:
+            return min(self.bytes / self.totalBytes, 1.0)
+
+        return min((self.files + self.failed) / self.totalFiles, 1.0) if self.totalFiles else 0.0
+
+    def eta(self):
+        files_per_second, mb_per_second = self.rate()
+        if self.totalBytes and mb_per_second > 0:
+            return max(self.totalBytes - self.bytes, 0) / (mb_per_second * 1e6)
+
+        if files_per_second > 0:
+            return max(self.totalFiles - self.files - self.failed, 0) / files_per_second
+
+        return None
+
+    def progress_string(self):
+        eta = self.eta()
+        eta = f", ETA {int(eta) // 60}m{int(eta) % 60:02d}s" if eta is not None else ""
+        failed = f", {self.failed} failed" if self.failed else ""
+        return f"{self.files}/{self.totalFiles} files, {self.bytes / 1e6:.1f}/{self.totalBytes / 1e6:.1f} MB, {self.rate_string()}{eta}{failed}"
+
+    def failure_summary(self, limit=20):
+        lines = [f"  {name}: {error}" for name, error in self.failures[:limit]]
+        if len(self.failures) > limit:
+            lines.append(f"  ... and {len(self.failures) - limit} more")
+
+        return '\n'.join(lines)
+
+    def __str__(self):
+        failed = f", {self.failed} failed" if self.failed else ""
+        skipped = f", {self.skipped} up to date" if self.skipped else ""
+        incomplete = ", listing incomplete" if self.listingError else ""
+        return f"{self.files} files, {self.bytes / 1e6:.1f} MB in {self.elapsed():.1f}s ({self.rate_string()}){skipped}{failed}{incomplete}"
+
+
+class TransferJob:
+    # one download or upload, run(job) does the transfer and reports into job.stats, watching job.cancelled
+    def __init__(self, name, run, priority=PRIORITY_NORMAL, on_done=None, batch=None):
+        self.name = name
+        self.run = run
+        self.priority = priority
+        self.onDone = on_done
+        self.batch = batch
+        self.stats = TransferStats()
+        self.cancelled = threading.Event()
+        self.state = 'queued'
+        self.result = None
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def __str__(self):
+        return f"{self.name}: {self.state}, {self.stats.progress_string()}"
+
+
+class TransferManager:
+    # runs transfer jobs one after the other on a daemon thread, by priority and then in order of submission
+    def __init__(self):
+        self.queue = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.current = None
+        self.last = None
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def submit(self, job):
+        with self.condition:
+            heapq.heappush(self.queue, (job.priority, next(self.sequence), job))
+            self.condition.notify()
+
+        return job
+
+    def prioritize(self, job):
+        # moves a queued job in front of everything else that is waiting
+        with self.condition:
+            job.priority = min([PRIORITY_HIGH] + [queued.priority for _, _, queued in self.queue]) - 1
+            self.queue = [(queued.priority, sequence, queued) for _, sequence, queued in self.queue]
+            heapq.heapify(self.queue)
+
+    def pending(self):
+        with self.condition:
+            return [job for _, _, job in sorted(self.queue) if not job.cancelled.is_set()]
+
+    def find(self, batch):
+        with self.condition:
+            jobs = [self.current] + [job for _, _, job in self.queue]
+
+        return next((job for job in jobs if job is not None and job.batch == batch and not job.cancelled.is_set()), None)
+
+    def cancel_all(self):
+        with self.condition:
+            jobs = [self.current] + [job for _, _, job in self.queue]
+
+        for job in jobs:
+            if job is not None:
+                job.cancel()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+
+                _, _, job = heapq.heappop(self.queue)
+                started = not job.cancelled.is_set()
+                if started:
+                    self.current = job
+
+            if not started:
+                # never started, on_done still runs so whoever waits for the job learns it ended
+                job.state = 'cancelled'
+                job.stats.finish()
+                self.finish(job)
+                continue
+
+            # the rate and ETA count from the moment the job starts, not from when it was queued
+            job.stats.started = time.perf_counter()
+            job.state = 'running'
+            try:
+                job.result = job.run(job)
+                job.state = 'cancelled' if job.cancelled.is_set() else 'done'
+            except Exception as error:
+                job.state = 'failed'
+                print(f"An error occurred: {error}")
+
+            job.stats.finish()
+            with self.condition:
+                self.current = None
+                self.last = job
+
+            self.finish(job)
+
+    def finish(self, job):
+        if job.onDone is not None:
+            try:
+                job.onDone(job)
+            except Exception as error:
+                print(f"An error occurred: {error}")
 
 
 def list_folders_in_folder(local_directory):
@@ -56,28 +494,84 @@ def list_folders_in_folder_azure(url, container, code, folder_path):
     if folder_path and not folder_path.endswith('/'):
         folder_path += '/'
 
-    try:
-        list_url = f"{url}{container}?restype=container&comp=list&prefix={folder_path}&delimiter=/&{code}"
-        response = requests.get(list_url)
-        response.raise_for_status()
+    folders = []
+    for kind, prefix_text in iter_blob_listing(url, container, code, folder_path, '/'):
+        if kind == 'prefix' and prefix_text and prefix_text != folder_path.rstrip('/'):
+            subfolder = prefix_text[len(folder_path):].rstrip('/')
+            if subfolder:
+                folders.append(subfolder)
+
+    return folders
+
+
+def parse_blob_element(blob):
+    properties = blob.find('Properties')
+    return {
+        'name': blob.findtext('Name'),
+        'etag': properties.findtext('Etag') if properties is not None else None,
+        'size': int(properties.findtext('Content-Length') or 0) if properties is not None else None,
+        'last_modified': properties.findtext('Last-Modified') if properties is not None else None,
+        'content_md5': (properties.findtext('Content-MD5') or None) if properties is not None else None,
+    }
+
+
+def iter_blob_listing(url, container, code, folder_path, delimiter=''):
+    # yields ('blob', properties) and ('prefix', name) entries page by page, following NextMarker,
+    # every page is parsed incrementally while it streams in, a page that fails is requested again from
+    # its marker and the entries it already yielded are skipped, the last failure is raised to the caller
+    marker = ''
+    while True:
+        list_url = f"{url}{container}?restype=container&comp=list&prefix={folder_path}"
+        if delimiter:
+            list_url += f"&delimiter={quote(delimiter, safe='')}"
+        if marker:
+            list_url += f"&marker={quote(marker, safe='')}"
+        list_url += f"&{code}"
+
+        yielded = 0
+        for attempt in range(TRANSFER_RETRIES):
+            next_marker = ''
+            seen = 0
+            try:
+                with get_session().get(list_url, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+                    response.raise_for_status()
+                    response.raw.decode_content = True
+                    for _, element in ElementTree.iterparse(response.raw):
+                        entry = None
+                        if element.tag == 'Blob':
+                            entry = 'blob', parse_blob_element(element)
+                            element.clear()
+                        elif element.tag == 'BlobPrefix':
+                            entry = 'prefix', element.findtext('Name')
+                            element.clear()
+                        elif element.tag == 'NextMarker':
+                            next_marker = element.text or ''
+
+                        if entry is not None:
+                            seen += 1
+                            if seen > yielded:
+                                yielded = seen
+                                yield entry
+
+                break
+            except Exception as error:
+                if attempt == TRANSFER_RETRIES - 1 or not is_retryable(error):
+                    raise
+
+                time.sleep(get_retry_delay(attempt))
+
+        if not next_marker:
+            return
 
-        folders = []
-        for blob_prefix in ElementTree.fromstring(response.content).findall('.//BlobPrefix'):
-            name_element = blob_prefix.find('Name')
-            if name_element is not None and name_element.text:
-                prefix_text = name_element.text
-                if prefix_text != folder_path.rstrip('/'):
-                    subfolder = prefix_text[len(folder_path):].rstrip('/')
-                    if subfolder:
-                        folders.append(subfolder)
-
-        return folders
-    except Exception as error:
-        print(f"An error occurred: {error}")
-        return []
+        marker = next_marker
 
 
 def list_blobs_in_folder(url, container, code, folder_path):
+    for blob in list_blob_properties(url, container, code, folder_path):
+        yield blob['name']
+
+
+def list_blob_properties(url, container, code, folder_path):
     if not url:
         print("The url is empty!")
         return
@@ -94,15 +588,66 @@ def list_blobs_in_folder(url, container, code, folder_path):
         print("The folder path is empty!")
         return
 
+    # a listing that still fails after its retries is raised, a truncated list would pass for the whole folder
+    for kind, blob in iter_blob_listing(url, container, code, folder_path):
+        if kind == 'blob':
+            yield blob
+
+
+def get_manifest_path(local_directory, folder):
+    return os.path.join(local_directory, '.manifests', f"{folder.strip('/')}.json")
+
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+
     try:
-        url = f"{url}{container}?restype=container&comp=list&prefix={folder_path}&{code}"
-        response = requests.get(url)
-        response.raise_for_status()
-        blobs = [blob.find('Name').text for blob in ElementTree.fromstring(response.content).findall('.//Blob')]
-        return blobs
+        with open(manifest_path, 'r') as file:
+            return json.load(file)
     except Exception as error:
-        print(f"An error occurred: {error}")
-        return []
+        print(f"Failed to read manifest {manifest_path}: {error}")
+        return {}
+
+
+def save_manifest(manifest_path, manifest):
+    try:
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        # a temp file of its own, threads saving the same manifest never write into each other's
+        fd, tmp_path = tempfile.mkstemp(prefix=f"{os.path.basename(manifest_path)}.", suffix='.tmp', dir=os.path.dirname(manifest_path))
+        try:
+            with os.fdopen(fd, 'w') as file:
+                json.dump(manifest, file)
+
+            os.replace(tmp_path, manifest_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    except Exception as error:
+        print(f"Failed to save manifest {manifest_path}: {error}")
+
+
+def get_manifest_entry(blob):
+    return {'etag': blob['etag'], 'size': blob['size'], 'last_modified': blob['last_modified'], 'content_md5': blob.get('content_md5')}
+
+
+def is_blob_up_to_date(blob, local_path, manifest):
+    known = manifest.get(blob['name'])
+    if known and known.get('evicted'):
+        # dropped by the disk cache and unchanged on the server since, not fetched again
+        return known.get('etag') == blob['etag'] or bool(known.get('content_md5') and known.get('content_md5') == blob.get('content_md5'))
+
+    if not known or not os.path.isfile(local_path):
+        return False
+
+    if known.get('size') != blob['size'] or os.path.getsize(local_path) != blob['size']:
+        return False
+
+    # a re-upload of identical content gets a new etag but keeps its MD5
+    if known.get('content_md5') and known.get('content_md5') == blob.get('content_md5'):
+        return True
+
+    return known.get('etag') == blob['etag']
 
 
 def get_blob_properties(blob_url):
@@ -111,7 +656,7 @@ def get_blob_properties(blob_url):
         return
 
     try:
-        response = requests.head(blob_url)
+        response = get_session().head(blob_url)
         response.raise_for_status()
         return {'last_modified': datetime.strptime(response.headers['Last-Modified'], '%a, %d %b %Y %H:%M:%S %Z')}
     except Exception as error:
@@ -119,40 +664,156 @@ def get_blob_properties(blob_url):
         return {}
 
 
-def download_blob(blob_url, local_path, tqdm_used=False):
+def get_file_md5(file_path):
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            md5.update(chunk)
+
+    return base64.b64encode(md5.digest()).decode('ascii')
+
+
+@timed('download_blob')
+def fetch_blob(blob_url, local_path, expected_size=None, content_md5=None, cancel_event=None, etag=None):
+    # downloads into local_path.part and renames it into place once length and MD5 check out, so an interrupted
+    # download never leaves a truncated file behind, a .part left by an earlier attempt is resumed with a Range request,
+    # only if it still belongs to the same version of the blob: its ETag is kept in .part.etag and sent as If-Match
+    part_path = f"{local_path}.part"
+    etag_path = f"{part_path}.etag"
+    etag = etag.strip('"') if etag else None
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+
+    def discard_part():
+        for path in (part_path, etag_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def attempt():
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        part_etag = None
+        if offset:
+            if os.path.exists(etag_path):
+                with open(etag_path, 'r') as file:
+                    part_etag = file.read().strip() or None
+
+            # a .part of another version, or of one that can't be told, is no use
+            if part_etag is None or (etag is not None and part_etag != etag) or (expected_size is not None and offset > expected_size):
+                discard_part()
+                offset = 0
+
+        size = expected_size
+        server_md5 = content_md5
+        if not (offset and offset == expected_size):
+            headers = {'Range': f"bytes={offset}-", 'If-Match': f'"{part_etag}"'} if offset else {}
+            with get_session().get(blob_url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+                if response.status_code in (412, 416):
+                    # the blob changed since the .part was started
+                    discard_part()
+                    raise BlobIntegrityError("stale partial download")
+
+                response.raise_for_status()
+                if response.status_code == 206:
+                    size = size or int(response.headers['Content-Range'].rsplit('/', 1)[1])
+                else:
+                    # the server sent the whole blob, the .part starts over
+                    offset = 0
+                    size = size or int(response.headers.get('Content-Length') or 0) or None
+                    server_md5 = server_md5 or response.headers.get('Content-MD5')
+
+                response_etag = (response.headers.get('ETag') or '').strip('"') or etag
+                if not offset and response_etag:
+                    write_file_atomic(etag_path, response_etag)
+
+                server_md5 = server_md5 or response.headers.get('x-ms-blob-content-md5')
+                with open(part_path, 'ab' if offset else 'wb') as file:
+                    for chunk in response.iter_content(chunk_size=65536):
+                        if cancel_event is not None and cancel_event.is_set():
+                            # the .part stays, a later download resumes it
+                            return None
+
+                        file.write(chunk)
+
+        received = os.path.getsize(part_path)
+        if size is not None and received != size:
+            raise BlobIntegrityError(f"got {received} of {size} bytes")
+
+        if server_md5 and get_file_md5(part_path) != server_md5:
+            discard_part()
+            raise BlobIntegrityError("Content-MD5 mismatch")
+
+        os.replace(part_path, local_path)
+        if os.path.exists(etag_path):
+            os.remove(etag_path)
+
+        return received
+
+    # every retry resumes from what the previous attempts left in the .part
+    return with_retries(attempt)
+
+
+def download_blob(blob_url, local_path, tqdm_used=False, cancel_event=None, expected_size=None, content_md5=None, etag=None):
     if not blob_url:
         if not tqdm_used:
             print("The blob url is empty!")
 
         return
 
-    # download always
-    # if os.path.exists(local_path):
-    #     blob_last_modified = get_blob_properties(blob_url).get('last_modified')
-    #     if blob_last_modified and blob_last_modified <= datetime.fromtimestamp(os.path.getmtime(local_path)):
-    #         if not tqdm_used:
-    #             print(f"Local file is up to date: {local_path}")
-    #         return
-
     try:
-        response = requests.get(blob_url, stream=True)
-        response.raise_for_status()
-        os.makedirs(os.path.dirname(local_path), exist_ok=True)
-        with open(local_path, 'wb') as file:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    file.write(chunk)
-
-        file.close()
-
-        if not tqdm_used:
+        size = fetch_blob(blob_url, local_path, expected_size, content_md5, cancel_event, etag)
+        if size is not None and not tqdm_used:
             print(f"Blob downloaded successfully and saved as {local_path}")
+
+        return size
     except Exception as error:
-        if not tqdm_used:
-            print(f"An error occurred: {error}")
+        # the url carries the SAS code and is never printed
+        print(f"Failed to download {local_path}: {describe_error(error)}")
+
+
+def get_archive_member_path(member):
+    # member names are relative to the folder the archive sits in, nothing may land outside of it
+    name = os.path.normpath(member.name).replace('\\', '/')
+    if os.path.isabs(name) or name == '..' or name.startswith('../') or ':' in name:
+        return None
+
+    return name
+
+
+@timed('extract_archive')
+def extract_archive(blob_url, target_dir, keep=None, cancel_event=None):
+    # streams a tar blob (plain or gzipped) through the extractor, the archive itself is never stored,
+    # every member is written to a .part and renamed into place, returns the extracted names relative to target_dir
+    import tarfile
+
+    def attempt():
+        extracted = []
+        with get_session().get(blob_url, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+            with tarfile.open(fileobj=response.raw, mode='r|*') as archive:
+                for member in archive:
+                    if cancel_event is not None and cancel_event.is_set():
+                        return None
+
+                    name = get_archive_member_path(member) if member.isfile() else None
+                    if name is None or (keep is not None and not keep(name)):
+                        continue
+
+                    local_path = os.path.join(target_dir, name)
+                    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                    with archive.extractfile(member) as source, open(f"{local_path}.part", 'wb') as target:
+                        shutil.copyfileobj(source, target)
+
+                    os.replace(f"{local_path}.part", local_path)
+                    extracted.append(name)
 
+        return extracted
 
-def download_folder(url, container, code, folder, local_directory):
+    # a broken stream restarts the archive, members already written are simply written again
+    return with_retries(attempt)
+
+
+@timed('download_folder')
+def download_folder(url, container, code, folder, local_directory, concurrency=TRANSFER_CONCURRENCY, sync=False, stats=None, cancel_event=None, keep_local=None):
+    # keep_local(blob name, local path) is asked right before a blob is written, True leaves the local file as it is
     if not url:
         print("The url is empty!")
         return
@@ -172,15 +833,242 @@ def download_folder(url, container, code, folder, local_directory):
         print(f"Path isn't a directory: {local_directory}")
         return []
 
-    print(f"Downloading folder: {folder}")
+    print(f"{'Syncing' if sync else 'Downloading'} folder: {folder}")
+
+    if not folder:
+        print("The folder path is empty!")
+        return
+
+    from tqdm import tqdm
+
+    manifest_path = get_manifest_path(local_directory, folder)
+    manifest = load_manifest(manifest_path) if sync else {}
+    new_manifest = {}
+    concurrency = max(int(concurrency), 1)
+    get_session(concurrency)
+    # a caller that shows progress passes its own stats and reads them while the download runs
+    stats = stats if stats is not None else TransferStats()
+    cancel_event = cancel_event or threading.Event()
+    lock = threading.Lock()
+    listed = 0
+    listing_complete = True
+    file_futures = []
+    archives = []
+    # last modified of the individually listed blobs, an archive member never replaces a newer single blob
+    modified = {}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor, tqdm(total=0, desc="Downloading files", unit="file") as progress:
+        def on_done(future, blob):
+            if future.cancelled():
+                return
+
+            error = future.exception()
+            size = future.result() if error is None else None
+            if size is None and error is None:
+                # cancelled while downloading
+                return
+
+            stats.add(size, blob['name'], error)
+            with lock:
+                if size is not None:
+                    new_manifest[blob['name']] = get_manifest_entry(blob)
+
+                progress.set_postfix_str(stats.rate_string(), refresh=False)
+                progress.update()
+
+        def on_archive_done(future, blob):
+            if future.cancelled():
+                return
+
+            error = future.exception()
+            extracted = future.result() if error is None else None
+            if extracted is None and error is None:
+                return
+
+            stats.add(blob['size'] if error is None else None, blob['name'], error)
+            if extracted:
+                stats.add_completed([f"{folder}/{name}" for name in extracted])
+
+            with lock:
+                if error is None:
+                    new_manifest[blob['name']] = get_manifest_entry(blob)
+
+                progress.update()
+
+        def keep_member(archive_blob, member_name):
+            if keep_local is not None and keep_local(f"{folder}/{member_name}", os.path.join(local_directory, folder, member_name)):
+                return False
+
+            single = modified.get(f"{folder}/{member_name}")
+            return single is None or parsedate_to_datetime(single) <= parsedate_to_datetime(archive_blob['last_modified'])
+
+        def fetch(blob, blob_url, local_path):
+            if keep_local is not None and keep_local(blob['name'], local_path):
+                stats.keep(blob['name'], blob['size'])
+                with lock:
+                    progress.update()
+
+                return None
+
+            return fetch_blob(blob_url, local_path, blob['size'], blob.get('content_md5'), cancel_event, blob['etag'])
+
+        # downloads start on the first listing page while later pages are still being fetched,
+        # the listing already carries etag and size, so a sync needs no extra request per blob
+        try:
+            for kind, blob in iter_blob_listing(url, container, code, folder):
+                if cancel_event.is_set():
+                    listing_complete = False
+                    executor.shutdown(cancel_futures=True)
+                    break
+
+                if kind != 'blob':
+                    continue
+
+                listed += 1
+                if ARCHIVE_PATTERN.match(blob['name'][len(folder):].lstrip('/')):
+                    archives.append(blob)
+                    continue
+
+                if blob['last_modified']:
+                    modified[blob['name']] = blob['last_modified']
+
+                local_path = os.path.join(local_directory, blob['name']).replace('\\', '/')
+                if sync and is_blob_up_to_date(blob, local_path, manifest):
+                    with lock:
+                        new_manifest[blob['name']] = get_manifest_entry(blob)
+                        if manifest[blob['name']].get('evicted'):
+                            new_manifest[blob['name']]['evicted'] = True
+
+                    stats.skipped += 1
+                    continue
+
+                blob_url = f"{url}{container}/{blob['name']}?{code}"
+                stats.expect(blob['size'], blob['name'])
+                with lock:
+                    progress.total += 1
+                    progress.refresh()
+
+                future = executor.submit(fetch, blob, blob_url, local_path)
+                future.add_done_callback(lambda done, listed_blob=blob: on_done(done, listed_blob))
+                file_futures.append(future)
+        except Exception as error:
+            listing_complete = False
+            stats.listingError = describe_error(error)
+
+        # archives are extracted once the single blobs are in place, where both have a file the newer one wins
+        if archives and not cancel_event.is_set():
+            wait(file_futures)
+
+        for blob in archives:
+            if cancel_event.is_set():
+                break
+
+            known = manifest.get(blob['name'])
+            if sync and known and (known.get('etag') == blob['etag'] or (known.get('content_md5') and known.get('content_md5') == blob.get('content_md5'))):
+                with lock:
+                    new_manifest[blob['name']] = get_manifest_entry(blob)
+
+                stats.skipped += 1
+                continue
+
+            blob_url = f"{url}{container}/{blob['name']}?{code}"
+            stats.expect(blob['size'], blob['name'])
+            with lock:
+                progress.total += 1
+                progress.refresh()
+
+            target_dir = os.path.join(local_directory, folder)
+            future = executor.submit(extract_archive, blob_url, target_dir, lambda name, archive_blob=blob: keep_member(archive_blob, name), cancel_event)
+            future.add_done_callback(lambda done, archive_blob=blob: on_archive_done(done, archive_blob))
+
+        # every blob to fetch is known from here on, archives included
+        stats.listingDone = listing_complete
+
+        if cancel_event.is_set():
+            executor.shutdown(cancel_futures=True)
+
+    if sync and not listing_complete:
+        # keep what we knew about blobs the broken listing didn't reach
+        new_manifest = {**manifest, **new_manifest}
+
+    if listed or not listing_complete:
+        save_manifest(manifest_path, new_manifest)
+
+    print(f"{'Cancelled download, got' if cancel_event.is_set() else 'Downloaded'} {stats}")
+    if stats.failures:
+        print(f"Failed to download {len(stats.failures)} blobs of {folder}:\n{stats.failure_summary()}")
+
+    if stats.listingError:
+        print(f"Listing of {folder} broke off after {listed} blobs, the rest was not downloaded: {stats.listingError}")
+
+    return stats
+
+
+@timed('put_blob')
+def put_blob(blob_url, file_path, size):
+    with open(file_path, 'rb') as file:
+        headers = {
+            'x-ms-blob-type': 'BlockBlob',
+            'Content-Length': str(size),
+        }
+
+        # the file object is streamed by requests instead of being read into memory
+        response = get_session().put(blob_url, data=file, headers=headers)
+        response.raise_for_status()
+
 
-    for blob in tqdm(list_blobs_in_folder(url, container, code, folder), desc="Downloading files"):
-        local_path = os.path.join(local_directory, blob).replace('\\', '/')
-        blob_url = f"{url}{container}/{blob}?{code}"
-        download_blob(blob_url, local_path, True)
+def put_block(blob_url, file_path, block_id, offset, length):
+    with open(file_path, 'rb') as file:
+        file.seek(offset)
+        block = file.read(length)
 
+    put_block_data(blob_url, block_id, block)
 
-def upload_file(file_path, url, container, code, blob_name, tqdm_used=False):
+
+@timed('put_block')
+def put_block_data(blob_url, block_id, block):
+    response = get_session().put(f"{blob_url}&comp=block&blockid={quote(block_id)}", data=block, headers={'Content-Length': str(len(block))})
+    response.raise_for_status()
+
+
+@timed('put_block_list')
+def put_block_list(blob_url, block_ids):
+    body = '<?xml version="1.0" encoding="utf-8"?><BlockList>'
+    body += ''.join(f"<Latest>{block_id}</Latest>" for block_id in block_ids)
+    body += '</BlockList>'
+    response = get_session().put(f"{blob_url}&comp=blocklist", data=body.encode('utf-8'))
+    response.raise_for_status()
+
+
+def get_block_id(index):
+    # all block ids of a blob must have the same length
+    return base64.b64encode(f"block-{index:08d}".encode('ascii')).decode('ascii')
+
+
+def upload_blocks(blob_url, file_path, size, block_executor=None):
+    block_ids = []
+    offsets = range(0, size, BLOCK_SIZE)
+    executor = block_executor or ThreadPoolExecutor(max_workers=BLOCK_CONCURRENCY)
+    try:
+        futures = []
+        for index, offset in enumerate(offsets):
+            block_id = get_block_id(index)
+            block_ids.append(block_id)
+            length = min(BLOCK_SIZE, size - offset)
+            # every block is retried on its own, a transient failure doesn't restart the whole file
+            futures.append(executor.submit(with_retries, lambda b=block_id, o=offset, n=length: put_block(blob_url, file_path, b, o, n)))
+
+        for future in futures:
+            future.result()
+    finally:
+        if block_executor is None:
+            executor.shutdown()
+
+    with_retries(lambda: put_block_list(blob_url, block_ids))
+
+
+@timed('upload_file')
+def upload_file(file_path, url, container, code, blob_name, tqdm_used=False, block_executor=None):
     if not os.path.exists(file_path):
         if not tqdm_used:
             print(f"File not found: {file_path}")
@@ -213,26 +1101,23 @@ def upload_file(file_path, url, container, code, blob_name, tqdm_used=False):
 
     blob_url = f"{url}{container}/{blob_name}?{code}"
     try:
-        with open(file_path, 'rb') as file:
-            file_content = file.read()
-            headers = {
-                'x-ms-blob-type': 'BlockBlob',
-                'Content-Length': str(len(file_content)),
-            }
-
-            response = requests.put(blob_url, data=file_content, headers=headers)
-            response.raise_for_status()
+        size = os.path.getsize(file_path)
+        if size <= BLOCK_SIZE:
+            with_retries(lambda: put_blob(blob_url, file_path, size))
+        else:
+            upload_blocks(blob_url, file_path, size, block_executor)
 
-            if not tqdm_used:
-                print(f"Uploaded file: {file_path}")
+        if not tqdm_used:
+            print(f"Uploaded file: {file_path}")
 
-        file.close()
+        return size
     except Exception as error:
         if not tqdm_used:
             print(f"An error occurred: {error}")
 
 
-def upload_folder(local_folder, url, container, code, folder):
+@timed('upload_folder')
+def upload_folder(local_folder, url, container, code, folder, concurrency=TRANSFER_CONCURRENCY, files=None, stats=None, cancel_event=None):
     if not local_folder or not os.path.isdir(local_folder):
         print("The directory doesn't exist or is empty!")
         return
@@ -255,65 +1140,1464 @@ def upload_folder(local_folder, url, container, code, folder):
 
     print(f"Uploading folder: {folder}")
 
-    for base, _, files in os.walk(local_folder):
-        for file_name in tqdm(files, desc="Uploading files"):
-            file_path = os.path.join(base, file_name)
-            blob_name = os.path.relpath(file_path, local_folder).replace("\\", "/")
-            upload_file(file_path, url, container, code, f"{folder}/{blob_name}", True)
+    from tqdm import tqdm
+
+    concurrency = max(int(concurrency), 1)
+    get_session(concurrency * 2)
+    stats = stats if stats is not None else TransferStats()
+    cancel_event = cancel_event or threading.Event()
+
+    # blocks go to their own pool, file workers wait on it and must not starve it
+    # files limits the upload to the given paths relative to local_folder
+    if files is None:
+        files = []
+        for base, _, file_names in os.walk(local_folder):
+            for file_name in file_names:
+                files.append(os.path.relpath(os.path.join(base, file_name), local_folder).replace("\\", "/"))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor, ThreadPoolExecutor(max_workers=concurrency) as block_executor:
+        futures = {}
+        for blob_name in files:
+            file_path = os.path.join(local_folder, blob_name)
+            stats.expect(os.path.getsize(file_path) if os.path.isfile(file_path) else 0)
+            futures[executor.submit(upload_file, file_path, url, container, code, f"{folder}/{blob_name}", True, block_executor)] = blob_name
+
+        with tqdm(total=len(futures), desc="Uploading files", unit="file") as progress:
+            for future in as_completed(futures):
+                if cancel_event.is_set():
+                    # files already being sent finish, the ones still waiting are dropped
+                    executor.shutdown(cancel_futures=True)
+
+                if future.cancelled():
+                    continue
+
+                stats.add(future.result(), futures[future])
+                progress.set_postfix_str(stats.rate_string(), refresh=False)
+                progress.update()
+
+    print(f"{'Cancelled upload, sent' if cancel_event.is_set() else 'Uploaded'} {stats}")
+    return stats
+
+
+class BlockWriter:
+    # write-only file object that uploads what is written to it as the blocks of one block blob,
+    # at most max_pending blocks are buffered while they are being sent
+    def __init__(self, blob_url, executor, max_pending=BLOCK_CONCURRENCY):
+        self.blobUrl = blob_url
+        self.executor = executor
+        self.maxPending = max_pending
+        self.buffer = bytearray()
+        self.blockIds = []
+        self.pending = []
+        self.size = 0
+
+    def write(self, data):
+        self.buffer += data
+        self.size += len(data)
+        while len(self.buffer) >= BLOCK_SIZE:
+            self.send_block(bytes(self.buffer[:BLOCK_SIZE]))
+            del self.buffer[:BLOCK_SIZE]
+
+        return len(data)
+
+    def send_block(self, block):
+        block_id = get_block_id(len(self.blockIds))
+        self.blockIds.append(block_id)
+        self.pending.append(self.executor.submit(with_retries, lambda: put_block_data(self.blobUrl, block_id, block)))
+        while len(self.pending) > self.maxPending:
+            self.pending.pop(0).result()
+
+    def commit(self):
+        # nothing is visible on the server until the block list is committed
+        if self.buffer:
+            self.send_block(bytes(self.buffer))
+            self.buffer.clear()
+
+        for future in self.pending:
+            future.result()
+
+        self.pending = []
+        with_retries(lambda: put_block_list(self.blobUrl, self.blockIds))
+
+
+@timed('upload_archive')
+def upload_archive(local_folder, url, container, code, blob_name, files=None, arcname_prefix='', stats=None, cancel_event=None):
+    # packs the files into one tar.gz blob while it uploads, without a local copy of the archive,
+    # one blob instead of a request per file
+    import tarfile
+
+    if not local_folder or not os.path.isdir(local_folder):
+        print("The directory doesn't exist or is empty!")
+        return
+
+    if not url or not container or not code:
+        print("The url, container or code is empty!")
+        return
+
+    print(f"Uploading {local_folder} as archive {blob_name}")
+    stats = stats if stats is not None else TransferStats()
+    cancel_event = cancel_event or threading.Event()
+    if files is None:
+        files = sorted(os.listdir(local_folder))
+
+    files = [name for name in files if os.path.isfile(os.path.join(local_folder, name))]
+    for name in files:
+        stats.expect(os.path.getsize(os.path.join(local_folder, name)))
+
+    get_session(BLOCK_CONCURRENCY)
+    blob_url = f"{url}{container}/{blob_name}?{code}"
+    sizes = {}
+    try:
+        with ThreadPoolExecutor(max_workers=BLOCK_CONCURRENCY) as block_executor:
+            writer = BlockWriter(blob_url, block_executor)
+            with tarfile.open(fileobj=writer, mode='w|gz') as archive:
+                for name in files:
+                    if cancel_event.is_set():
+                        # the uncommitted blocks are dropped by the server, the blob stays as it was
+                        print("Cancelled archive upload")
+                        return stats
+
+                    file_path = os.path.join(local_folder, name)
+                    sizes[name] = os.path.getsize(file_path)
+                    archive.add(file_path, arcname=f"{arcname_prefix}{name}")
+
+            writer.commit()
+    except Exception as error:
+        print(f"Failed to upload archive {blob_name}: {describe_error(error)}")
+        for name in files:
+            stats.add(None, name, error)
+
+        return stats
+
+    # the files only count as uploaded once the block list is committed
+    for name in files:
+        stats.add(sizes[name], name)
+
+    print(f"Uploaded {len(files)} files as {writer.size / 1e6:.2f} MB archive in {stats.elapsed():.1f}s")
+    return stats
+
+
+def hash_bytes(content):
+    return hashlib.sha1(content).hexdigest()
+
+
+def hash_file(file_path):
+    # in chunks, model weights and large images are never held in memory at once
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            sha1.update(chunk)
+
+    return sha1.hexdigest()
+
+
+def read_label_classes(label_path):
+    classes = []
+    with open(label_path, 'r') as file:
+        for line in file:
+            fields = line.split()
+            if fields and fields[0].isdigit():
+                classes.append(int(fields[0]))
+
+    return classes
+
+
+def read_image_size(image_path):
+    from PIL import Image
+
+    # only the header is read
+    with Image.open(image_path) as image:
+        return image.size
+
+
+class BatchIndex:
+    # per batch SQLite index of images and their labels, kept up to date from file mtimes and on every save,
+    # it is a cache next to the batch and is rebuilt when it can't be read
+    def __init__(self, batch_dir, extension):
+        self.batchDir = batch_dir
+        self.labelsDir = os.path.join(batch_dir, 'labels')
+        self.extension = extension
+        self.path = os.path.join(batch_dir, '.index.sqlite')
+        self.lock = threading.Lock()
+        self.closed = False
+        try:
+            self.connection = self.connect()
+        except sqlite3.DatabaseError as error:
+            print(f"Rebuilding batch index {self.path}: {error}")
+            os.remove(self.path)
+            self.connection = self.connect()
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS images (name TEXT PRIMARY KEY, image_mtime INTEGER, image_size INTEGER, '
+            'width INTEGER, height INTEGER, label_mtime INTEGER, box_count INTEGER NOT NULL DEFAULT 0)'
+        )
+        connection.execute('CREATE TABLE IF NOT EXISTS class_counts (name TEXT, class_index INTEGER, count INTEGER, PRIMARY KEY (name, class_index))')
+        connection.execute('CREATE INDEX IF NOT EXISTS class_counts_by_class ON class_counts (class_index)')
+        connection.commit()
+        return connection
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.connection.close()
+
+    def query(self, sql, parameters=()):
+        with self.lock:
+            if self.closed:
+                return []
+
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def names(self):
+        return [name for name, in self.query('SELECT name FROM images ORDER BY name')]
+
+    def refresh(self):
+        # one directory scan, only images and labels whose mtime or size changed since the last refresh are read
+        known = {name: (image_mtime, image_size, width, height, label_mtime) for name, image_mtime, image_size, width, height, label_mtime in
+                 self.query('SELECT name, image_mtime, image_size, width, height, label_mtime FROM images')}
+        label_mtimes = {}
+        if os.path.isdir(self.labelsDir):
+            for entry in os.scandir(self.labelsDir):
+                if entry.name.endswith('.txt'):
+                    label_mtimes[entry.name[:-len('.txt')]] = entry.stat().st_mtime_ns
+
+        suffix = f".{self.extension}"
+        seen = set()
+        rows = []
+        class_counts = {}
+        for entry in os.scandir(self.batchDir):
+            if not entry.name.endswith(suffix) or not entry.is_file():
+                continue
+
+            name = entry.name[:-len(suffix)]
+            stat = entry.stat()
+            label_mtime = label_mtimes.get(name)
+            seen.add(name)
+            row = known.get(name)
+            image_unchanged = row is not None and row[0] == stat.st_mtime_ns and row[1] == stat.st_size
+            if image_unchanged and row[4] == label_mtime:
+                continue
+
+            # sizes of new images are filled in later by fill_sizes, the open doesn't wait for the headers
+            width, height = row[2:4] if image_unchanged else (None, None)
+            classes = self.read_classes(name) if label_mtime is not None else []
+            class_counts[name] = classes
+            rows.append((name, stat.st_mtime_ns, stat.st_size, width, height, label_mtime, len(classes)))
+
+        removed = [(name,) for name in known if name not in seen]
+        with self.lock:
+            if self.closed:
+                return
+
+            self.connection.executemany('INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            self.connection.executemany('DELETE FROM images WHERE name = ?', removed)
+            self.connection.executemany('DELETE FROM class_counts WHERE name = ?', removed + [(name,) for name in class_counts])
+            self.connection.executemany('INSERT INTO class_counts VALUES (?, ?, ?)', self.count_rows(class_counts))
+            self.connection.commit()
+
+    def read_classes(self, name):
+        try:
+            return read_label_classes(os.path.join(self.labelsDir, f"{name}.txt"))
+        except OSError:
+            return []
+
+    def count_rows(self, class_counts):
+        rows = []
+        for name, classes in class_counts.items():
+            for class_index in set(classes):
+                rows.append((name, class_index, classes.count(class_index)))
+
+        return rows
+
+    def set_label(self, name, classes, label_mtime):
+        with self.lock:
+            if self.closed:
+                return
+
+            updated = self.connection.execute('UPDATE images SET label_mtime = ?, box_count = ? WHERE name = ?', (label_mtime, len(classes), name)).rowcount
+            if not updated:
+                # a streamed image the index has not seen on disk yet
+                self.connection.execute('INSERT INTO images (name, label_mtime, box_count) VALUES (?, ?, ?)', (name, label_mtime, len(classes)))
+
+            self.connection.execute('DELETE FROM class_counts WHERE name = ?', (name,))
+            self.connection.executemany('INSERT INTO class_counts VALUES (?, ?, ?)', self.count_rows({name: classes}))
+            self.connection.commit()
+
+    def fill_sizes(self):
+        # runs on a background thread after an open
+        for name, in self.query('SELECT name FROM images WHERE width IS NULL AND image_mtime IS NOT NULL'):
+            try:
+                width, height = read_image_size(os.path.join(self.batchDir, f"{name}.{self.extension}"))
+            except Exception as error:
+                print(f"An error occurred: {error}")
+                continue
+
+            with self.lock:
+                if self.closed:
+                    return
+
+                self.connection.execute('UPDATE images SET width = ?, height = ? WHERE name = ?', (width, height, name))
+
+        with self.lock:
+            if not self.closed:
+                self.connection.commit()
+
+    def labeled_names(self):
+        return {name for name, in self.query('SELECT name FROM images WHERE label_mtime IS NOT NULL')}
+
+    def names_with_class(self, class_index):
+        return {name for name, in self.query('SELECT name FROM class_counts WHERE class_index = ? AND count > 0', (class_index,))}
+
+    def stats(self):
+        images, labeled, boxes = self.query('SELECT COUNT(*), COUNT(label_mtime), COALESCE(SUM(box_count), 0) FROM images')[0]
+        classes = dict(self.query('SELECT class_index, SUM(count) FROM class_counts GROUP BY class_index ORDER BY class_index'))
+        return {'images': images, 'labeled': labeled, 'boxes': boxes, 'classes': classes}
+
+
+class LabelSyncState:
+    # content hashes of the label files of one batch, as last saved locally and as last uploaded
+    def __init__(self, batch_dir):
+        self.labelsDir = os.path.join(batch_dir, 'labels')
+        self.path = os.path.join(batch_dir, '.label_sync.json')
+        self.lock = threading.Lock()
+        state = load_manifest(self.path)
+        self.saved = state.get('saved', {})
+        self.uploaded = state.get('uploaded', {})
+
+    def save(self):
+        # held across the write, so an older state never replaces a newer one on disk
+        with self.lock:
+            save_manifest(self.path, {'saved': dict(self.saved), 'uploaded': dict(self.uploaded)})
+
+    def record_saved(self, name):
+        file_path = os.path.join(self.labelsDir, name)
+        content_hash = hash_file(file_path)
+        with self.lock:
+            self.saved[name] = {'hash': content_hash, 'mtime': os.stat(file_path).st_mtime_ns}
+
+        self.save()
+
+    def current_hash(self, name):
+        file_path = os.path.join(self.labelsDir, name)
+        saved = self.saved.get(name)
+        mtime = os.stat(file_path).st_mtime_ns
+        # the hash recorded at save time is trusted as long as nobody touched the file since
+        if saved and saved['mtime'] == mtime:
+            return saved['hash']
+
+        content_hash = hash_file(file_path)
+        with self.lock:
+            self.saved[name] = {'hash': content_hash, 'mtime': mtime}
+
+        return content_hash
+
+    def dirty_files(self):
+        dirty = {}
+        skipped = 0
+        if not os.path.isdir(self.labelsDir):
+            return dirty, skipped
+
+        for name in sorted(os.listdir(self.labelsDir)):
+            if not name.endswith('.txt'):
+                continue
+
+            content_hash = self.current_hash(name)
+            if self.uploaded.get(name) == content_hash:
+                skipped += 1
+            else:
+                dirty[name] = content_hash
+
+        return dirty, skipped
+
+    def mark_uploaded(self, hashes):
+        with self.lock:
+            self.uploaded.update(hashes)
+
+        self.save()
+
+    def mark_downloaded(self, names):
+        # freshly downloaded labels are identical to the server copy
+        hashes = {}
+        for name in names:
+            file_path = os.path.join(self.labelsDir, name)
+            if os.path.isfile(file_path):
+                hashes[name] = self.current_hash(name)
+
+        self.mark_uploaded(hashes)
+
+
+def load_config(config_file):
+    config = {'url': "", 'container': "", 'code': "", 'next_box_after_class_set': True, 'transfer_concurrency': TRANSFER_CONCURRENCY, 'stream_batches': False, 'label_archive_upload': False, 'cache_budget_gb': 0,
+              'inference_backend': 'auto', 'inference_imgsz': INFERENCE_IMGSZ, 'inference_threads': 0, 'inference_precision': 'fp32'}
+    if os.path.exists(config_file):
+        import yaml
+
+        with open(config_file, 'r') as file:
+            loaded_config = yaml.safe_load(file)
+            if loaded_config is not None:
+                config.update(loaded_config)
+
+        file.close()
+
+    return config
+
+
+def load_classes_from_file(model_dir, key):
+    classes_file = os.path.join(model_dir, 'data.yaml')
+    classes_dict = {0: "generic"}  # Initialize with 'generic' at index 0
+
+    if not os.path.exists(classes_file):
+        return classes_dict
+
+    import yaml
+
+    with open(classes_file, 'r') as file:
+        data = yaml.safe_load(file)
+        # Extract the values from the 'names' dictionary and sort by the key to ensure the order
+        classes_dict.update(data.get(key, {}))
+
+    return classes_dict
+
+
+def find_latest_model(model_dir):
+    # Get the latest .pt file based on modification time
+    pt_files = glob.glob(os.path.join(model_dir, '*.pt'))
+    if not pt_files:
+        return None
+
+    return max(pt_files, key=os.path.getmtime)
+
+
+def map_prediction_class(class_index, prediction_classes, class_indexes):
+    # YOLO classes are mapped by name onto the classes of the target model, unmapped ones are dropped
+    if class_index not in prediction_classes:
+        return None
+
+    index = class_indexes.get(prediction_classes[class_index])
+
+    # safety mechanism not to crash if yolo gives higher class then target model supports
+    return index if index is not None else 0
+
+
+def format_label_line(class_index, x1, y1, x2, y2):
+    # YOLO txt line from normalized corners: class, box center and box size
+    return f'{class_index} {(x1 + x2) / 2.} {(y1 + y2) / 2.} {abs(x1 - x2) * 1.} {abs(y1 - y2) * 1.}\n'
+
+
+def predictions_to_label_lines(boxes, prediction_classes, class_indexes):
+    lines = []
+    for class_index, x1, y1, x2, y2 in boxes:
+        index = map_prediction_class(class_index, prediction_classes, class_indexes)
+        if index is not None:
+            lines.append(format_label_line(index, x1, y1, x2, y2))
+
+    return lines
+
+
+def write_file_atomic(file_path, content):
+    # readers see either the old or the new file, never a half written one
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, 'w') as file:
+        file.write(content)
+
+    os.replace(tmp_path, file_path)
+
+
+def get_tree_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+
+    size = 0
+    for base, _, file_names in os.walk(path):
+        for file_name in file_names:
+            try:
+                size += os.path.getsize(os.path.join(base, file_name))
+            except OSError:
+                pass
+
+    return size
+
+
+class DiskCache:
+    # sizes and last use of the batches and models of one container on disk, evicts the coldest over a byte budget,
+    # a batch with labels that are not on the server, the open batch and the newest model are never evicted
+    def __init__(self, container_dir):
+        self.containerDir = container_dir
+        self.batchDir = os.path.join(container_dir, 'batches')
+        self.modelDir = os.path.join(container_dir, 'models')
+        self.accessPath = os.path.join(container_dir, '.manifests', 'cache_access.json')
+        self.hashPath = os.path.join(container_dir, '.manifests', 'model_hashes.json')
+        self.lock = threading.Lock()
+
+    def touch(self, key):
+        with self.lock:
+            access = load_manifest(self.accessPath)
+            access[key] = time.time()
+            save_manifest(self.accessPath, access)
+
+    def get_model_hashes(self, model_paths):
+        # weights are only re-hashed when the file on disk changed, kept next to the access times across runs
+        with self.lock:
+            known = load_manifest(self.hashPath)
+            hashes = {}
+            for model_path in model_paths:
+                stat = os.stat(model_path)
+                name = os.path.basename(model_path)
+                entry = known.get(name)
+                if entry is None or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+                    entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': hash_file(model_path)}
+
+                hashes[name] = entry
+
+            if hashes != known:
+                save_manifest(self.hashPath, hashes)
+
+        return {name: entry['hash'] for name, entry in hashes.items()}
+
+    def entries(self):
+        access = load_manifest(self.accessPath)
+        entries = []
+        if os.path.isdir(self.batchDir):
+            for batch in list_folders_in_folder(self.batchDir):
+                path = os.path.join(self.batchDir, batch)
+                dirty, _ = LabelSyncState(path).dirty_files()
+                key = f"batches/{batch}"
+                entries.append({'key': key, 'paths': [path], 'size': get_tree_size(path), 'last_access': access.get(key) or os.path.getmtime(path), 'unsynced': len(dirty), 'latest': False})
+
+        if os.path.isdir(self.modelDir):
+            latest = find_latest_model(self.modelDir)
+            model_paths = glob.glob(os.path.join(self.modelDir, '*.pt'))
+            hashes = self.get_model_hashes(model_paths)
+            exports = {name: match for name, match in ((name, EXPORT_NAME_PATTERN.match(name)) for name in os.listdir(self.modelDir)) if match}
+            for model_path in model_paths:
+                # only the exports of these very weights, those of older weights under the same name are evicted on their own
+                name = os.path.basename(model_path)
+                stem = os.path.splitext(name)[0]
+                own = [export for export, match in exports.items() if match['stem'] == stem and match['hash'] == hashes[name][:12]]
+                for export in own:
+                    del exports[export]
+
+                key = f"models/{name}"
+                paths = [model_path] + [os.path.join(self.modelDir, export) for export in own]
+                last_access = access.get(key) or os.path.getmtime(model_path)
+                entries.append({'key': key, 'paths': paths, 'size': sum(get_tree_size(path) for path in paths), 'last_access': last_access, 'unsynced': 0, 'latest': model_path == latest})
+
+            for export in exports:
+                key = f"models/{export}"
+                path = os.path.join(self.modelDir, export)
+                entries.append({'key': key, 'paths': [path], 'size': get_tree_size(path), 'last_access': access.get(key) or os.path.getmtime(path), 'unsynced': 0, 'latest': False})
+
+        return sorted(entries, key=lambda entry: entry['last_access'])
+
+    def evict(self, budget_bytes, keep=(), dry_run=False):
+        # coldest first until the total fits the budget, returns the evicted entries and the total left
+        entries = self.entries()
+        total = sum(entry['size'] for entry in entries)
+        evicted = []
+        for entry in entries:
+            if total <= budget_bytes:
+                break
+
+            if entry['key'] in keep or entry['unsynced'] or entry['latest']:
+                continue
+
+            if not dry_run:
+                self.remove(entry)
+
+            total -= entry['size']
+            evicted.append(entry)
+
+        return evicted, total
+
+    def remove(self, entry):
+        print(f"Evicting {entry['key']} ({entry['size'] / 1e6:.1f} MB) from the disk cache")
+        for path in entry['paths']:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
+
+        if entry['key'].startswith('batches/'):
+            # the next download of the batch fetches everything again
+            manifest_path = get_manifest_path(self.containerDir, entry['key'])
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+        else:
+            # the model stays known, so the model sync doesn't bring it back
+            manifest_path = get_manifest_path(self.containerDir, 'models')
+            manifest = load_manifest(manifest_path)
+            if entry['key'] in manifest:
+                manifest[entry['key']]['evicted'] = True
+                save_manifest(manifest_path, manifest)
+
+        with self.lock:
+            access = load_manifest(self.accessPath)
+            access.pop(entry['key'], None)
+            save_manifest(self.accessPath, access)
+
+    def report(self, budget_bytes=0, keep=()):
+        entries = self.entries()
+        total = sum(entry['size'] for entry in entries)
+        lines = [f"{'entry':40} {'MB':>10}  {'last used':16}  status"]
+        for entry in reversed(entries):
+            if entry['key'] in keep:
+                status = "open"
+            elif entry['unsynced']:
+                status = f"{entry['unsynced']} labels not uploaded"
+            elif entry['latest']:
+                status = "current model"
+            else:
+                status = "evictable"
+
+            last_used = datetime.fromtimestamp(entry['last_access']).strftime('%Y-%m-%d %H:%M')
+            lines.append(f"{entry['key'][:40]:40} {entry['size'] / 1e6:10.1f}  {last_used:16}  {status}")
+
+        budget = f" of {budget_bytes / 1e9:.2f} GB budget" if budget_bytes else ", no budget set"
+        lines.append(f"total {total / 1e9:.2f} GB{budget}")
+        return '\n'.join(lines)
+
+
+@timed('yolo')
+def predict_boxes(model, image_paths):
+    # one batched YOLO call, boxes come back as (yolo class, x1, y1, x2, y2) normalized to the image size
+    results = []
+    for result in model(image_paths, verbose=False):
+        boxes = []
+        for class_index, xyxyn in zip(result.boxes.cls.tolist(), result.boxes.xyxyn.tolist()):
+            boxes.append([int(class_index)] + [float(value) for value in xyxyn])
+
+        results.append(boxes)
+
+    return results
+
+
+def get_inference_options(config):
+    return {'backend': config['inference_backend'], 'imgsz': int(config['inference_imgsz']), 'threads': int(config['inference_threads']), 'precision': config['inference_precision']}
+
+
+def get_backend_candidates(backend):
+    import importlib.util
+
+    if backend not in INFERENCE_BACKENDS:
+        if backend != 'auto':
+            print(f"Unknown inference backend {backend}, trying {', '.join(INFERENCE_BACKENDS)}")
+
+        candidates = INFERENCE_BACKENDS
+    else:
+        candidates = [backend, 'pytorch']
+
+    # only runtimes that are installed, PyTorch comes with ultralytics
+    return [name for name in dict.fromkeys(candidates) if name == 'pytorch' or importlib.util.find_spec(INFERENCE_BACKEND_MODULES[name]) is not None]
+
+
+def get_export_path(model_path, model_hash, backend, imgsz, precision):
+    # next to the weights and named after them, so a changed .pt never picks up a stale export
+    name = f"{os.path.splitext(model_path)[0]}.{model_hash[:12]}-{imgsz}-{precision}"
+    return f"{name}.onnx" if backend == 'onnx' else f"{name}_openvino_model"
+
+
+def export_model(model_path, model_hash, backend, imgsz, precision):
+    export_path = get_export_path(model_path, model_hash, backend, imgsz, precision)
+    if os.path.exists(export_path):
+        return export_path
+
+    from ultralytics import YOLO
+
+    # ultralytics writes the export next to the weights it loaded, a private copy keeps parallel exports apart
+    print(f"Exporting {os.path.basename(model_path)} to {backend} at {imgsz} px {precision}...")
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(model_path)) as export_dir:
+        weights = shutil.copyfile(model_path, os.path.join(export_dir, os.path.basename(model_path)))
+        exported = YOLO(weights).export(format=backend, imgsz=imgsz, half=precision == 'fp16', dynamic=True, device='cpu')
+        try:
+            os.replace(exported, export_path)
+        except OSError:
+            # another process finished the same export first
+            if not os.path.exists(export_path):
+                raise
+
+    print(f"Exported {os.path.basename(export_path)} in {time.perf_counter() - started:.1f}s")
+    return export_path
+
+
+class InferenceModel:
+    # a YOLO model on one runtime, called like the YOLO model itself, key names its predictions
+    def __init__(self, yolo, backend, path, imgsz, threads, key):
+        self.yolo = yolo
+        self.backend = backend
+        self.path = path
+        self.imgsz = imgsz
+        self.threads = threads
+        self.key = key
+
+    def __call__(self, source, **kwargs):
+        return self.yolo(source, imgsz=self.imgsz, **kwargs)
+
+    def warm_up(self):
+        # the first call sets up the predictor, and shows a broken export before the annotator relies on it
+        import numpy
+
+        self(numpy.zeros((self.imgsz, self.imgsz, 3), dtype=numpy.uint8), verbose=False)
+        if self.threads and self.backend != 'pytorch':
+            self.set_runtime_threads()
+
+    def set_runtime_threads(self):
+        # ultralytics builds the runtime sessions with their default thread pools
+        runtime = getattr(getattr(self.yolo, 'predictor', None), 'model', None)
+        if self.backend == 'onnx' and hasattr(runtime, 'session'):
+            import onnxruntime
+
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = self.threads
+            runtime.session = onnxruntime.InferenceSession(self.path, options, providers=['CPUExecutionProvider'])
+        elif self.backend == 'openvino' and hasattr(runtime, 'ov_compiled_model'):
+            import openvino
+
+            core = openvino.Core()
+            xml_path = glob.glob(os.path.join(self.path, '*.xml'))[0]
+            runtime.ov_compiled_model = core.compile_model(core.read_model(xml_path), 'CPU', {'INFERENCE_NUM_THREADS': self.threads})
+        else:
+            print(f"Thread count not applied to this {self.backend} runtime")
+
+
+def load_inference_model(model_path, model_hash, options):
+    from ultralytics import YOLO
+
+    imgsz, threads, precision = options['imgsz'], options['threads'], options['precision']
+    if threads:
+        import torch
+
+        torch.set_num_threads(threads)
+
+    for backend in get_backend_candidates(options['backend']):
+        if backend == 'pytorch':
+            # predictions at the default size keep the key of the weights, so earlier cached predictions stay valid
+            key = model_hash if imgsz == INFERENCE_IMGSZ else f"{model_hash}-pytorch-{imgsz}"
+            model = InferenceModel(YOLO(model_path), backend, model_path, imgsz, threads, key)
+            model.warm_up()
+            return model
+
+        # ONNX Runtime has no fp16 kernels on the CPU
+        backend_precision = 'fp32' if backend == 'onnx' else precision
+        try:
+            export_path = export_model(model_path, model_hash, backend, imgsz, backend_precision)
+            model = InferenceModel(YOLO(export_path, task='detect'), backend, export_path, imgsz, threads, f"{model_hash}-{backend}-{imgsz}-{backend_precision}")
+            model.warm_up()
+            print(f"Running {os.path.basename(model_path)} on {backend}")
+            return model
+        except Exception as error:
+            print(f"Could not run {os.path.basename(model_path)} on {backend}, falling back: {error}")
+
+
+class ModelCache:
+    # constructed models by the content hash of their weights and the inference options, so unchanged weights are never loaded twice
+    def __init__(self, max_models=MODEL_CACHE_SIZE):
+        self.maxModels = max_models
+        self.models = OrderedDict()
+        self.hashes = {}
+        self.lock = threading.Lock()
+
+    def get_hash(self, model_path):
+        # weights are only re-hashed when the file on disk changed
+        stat = os.stat(model_path)
+        key = (os.path.abspath(model_path), stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            model_hash = self.hashes.get(key)
+
+        if model_hash is None:
+            model_hash = hash_file(model_path)
+            with self.lock:
+                self.hashes[key] = model_hash
+
+        return model_hash
+
+    def get(self, model_path, options):
+        model_hash = self.get_hash(model_path)
+        cache_key = (model_hash,) + tuple(sorted(options.items()))
+        with self.lock:
+            if cache_key in self.models:
+                self.models.move_to_end(cache_key)
+                model = self.models[cache_key]
+                return model.key, model
+
+        model = load_inference_model(model_path, model_hash, options)
+        with self.lock:
+            self.models[cache_key] = model
+            while len(self.models) > self.maxModels:
+                self.models.popitem(last=False)
+
+        return model.key, model
+
+
+class PredictionCache:
+    # YOLO boxes per image content hash, one SQLite file per model content hash, a save only commits the new rows
+    def __init__(self, cache_dir, model_hash):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, f"{model_hash}.sqlite")
+        self.lock = threading.Lock()
+        self.closed = False
+        try:
+            self.connection = self.connect()
+        except sqlite3.DatabaseError as error:
+            print(f"Rebuilding prediction cache {self.path}: {error}")
+            os.remove(self.path)
+            self.connection = self.connect()
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute('CREATE TABLE IF NOT EXISTS predictions (image_hash TEXT PRIMARY KEY, boxes TEXT NOT NULL)')
+        connection.commit()
+        return connection
+
+    def close(self):
+        # a pre-annotator that was stopped may still finish its current image, it then finds the cache closed
+        with self.lock:
+            if not self.closed:
+                self.closed = True
+                self.connection.commit()
+                self.connection.close()
+
+    def get(self, image_hash):
+        with self.lock:
+            if self.closed:
+                return None
+
+            row = self.connection.execute('SELECT boxes FROM predictions WHERE image_hash = ?', (image_hash,)).fetchone()
+
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, image_hash, boxes):
+        with self.lock:
+            if not self.closed:
+                self.connection.execute('INSERT OR REPLACE INTO predictions VALUES (?, ?)', (image_hash, json.dumps(boxes)))
+
+    def save(self):
+        with self.lock:
+            if not self.closed:
+                self.connection.commit()
+
+
+class PreAnnotator(threading.Thread):
+    # runs the model over the unlabeled images of a batch ahead of the annotator, more images can be added while it runs,
+    # e.g. as a streamed batch fetches them
+    def __init__(self, model, model_lock, cache, image_paths, get_image_hash):
+        super().__init__(daemon=True)
+        self.model = model
+        self.modelLock = model_lock
+        self.cache = cache
+        self.imagePaths = deque(image_paths)
+        self.getImageHash = get_image_hash
+        self.stopped = False
+        self.condition = threading.Condition()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def add(self, image_paths):
+        with self.condition:
+            self.imagePaths.extend(image_paths)
+            self.condition.notify_all()
+
+    def next_paths(self):
+        # waits for images to predict, None once stopped
+        with self.condition:
+            while not self.imagePaths and not self.stopped:
+                self.condition.wait()
+
+            if self.stopped:
+                return None
+
+            return [self.imagePaths.popleft() for _ in range(min(PREDICTION_BATCH_SIZE, len(self.imagePaths)))]
+
+    def run(self):
+        predicted = 0
+        started = time.perf_counter()
+        while True:
+            image_paths = self.next_paths()
+            if image_paths is None:
+                return
+
+            # the label may have been written since the listing, or the tool may have predicted it already
+            chunk = []
+            for image_path in image_paths:
+                try:
+                    image_hash = self.getImageHash(image_path)
+                except OSError:
+                    continue
+
+                if self.cache.get(image_hash) is None:
+                    chunk.append((image_path, image_hash))
+
+            if chunk:
+                if not predicted:
+                    started = time.perf_counter()
+
+                try:
+                    with self.modelLock:
+                        batch_boxes = predict_boxes(self.model, [image_path for image_path, _ in chunk])
+                except Exception as error:
+                    print(f"Pre-annotation failed: {error}")
+                    return
+
+                for (_, image_hash), boxes in zip(chunk, batch_boxes):
+                    self.cache.put(image_hash, boxes)
+
+                self.cache.save()
+                predicted += len(chunk)
+
+            with self.condition:
+                drained = not self.imagePaths
+
+            if drained and predicted:
+                print(f"Pre-annotated {predicted} images in {time.perf_counter() - started:.1f}s")
+                predicted = 0
+
+
+def get_display_size(size):
+    # from the size of the original image, so boxes map to the same normalized coordinates however it was decoded
+    img_factor = max(size[0] / 1000, size[1] / 1000., 1.)
+    return int(size[0] / img_factor) * ZOOM_RATIO, int(size[1] / img_factor) * ZOOM_RATIO
+
+
+@timed('decode')
+def load_display_image(full_file_path):
+    from PIL import Image
+
+    with Image.open(full_file_path) as loaded_img:
+        display_size = get_display_size(loaded_img.size)
+        # JPEGs are DCT-scaled by 1/2, 1/4 or 1/8 while decoding, to the smallest size still covering the display size,
+        # a 20MP frame is never decoded at full resolution, other formats ignore the draft
+        loaded_img.draft('RGB', display_size)
+        # a single resample straight to the zoomed size shown on the canvas
+        return loaded_img.resize(display_size, Image.BILINEAR)
+
+
+def get_image_bytes(image):
+    return image.width * image.height * len(image.getbands())
+
+
+class ImagePrefetcher:
+    # decodes images around the current one on a worker thread into a memory bounded LRU
+    def __init__(self, load, max_bytes=PREFETCH_CACHE_BYTES):
+        self.load = load
+        self.maxBytes = max_bytes
+        self.cache = OrderedDict()
+        self.cacheBytes = 0
+        self.wanted = []
+        self.loading = None
+        self.condition = threading.Condition()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def get_cached(self, path, mtime):
+        entry = self.cache.get(path)
+        if entry is None or entry[0] != mtime:
+            return None
+
+        self.cache.move_to_end(path)
+        return entry[1]
+
+    def put(self, path, mtime, image):
+        if path in self.cache:
+            self.cacheBytes -= get_image_bytes(self.cache.pop(path)[1])
+
+        self.cache[path] = (mtime, image)
+        self.cacheBytes += get_image_bytes(image)
+        while self.cacheBytes > self.maxBytes and len(self.cache) > 1:
+            _, (_, evicted) = self.cache.popitem(last=False)
+            self.cacheBytes -= get_image_bytes(evicted)
+
+    def get(self, path):
+        mtime = os.stat(path).st_mtime_ns
+        with self.condition:
+            # wait for the worker rather than decoding the same image twice
+            while self.loading == path:
+                self.condition.wait()
+
+            image = self.get_cached(path, mtime)
+            if image is not None:
+                return image
+
+            if path in self.wanted:
+                self.wanted.remove(path)
+
+        image = self.load(path)
+        with self.condition:
+            self.put(path, mtime, image)
+
+        return image
+
+    def prefetch(self, paths):
+        # replaces the previous request, so under key-repeat the images skipped over are never decoded
+        with self.condition:
+            self.wanted = [path for path in paths if path not in self.cache]
+            self.condition.notify_all()
+
+    def clear(self):
+        with self.condition:
+            self.wanted = []
+            self.cache.clear()
+            self.cacheBytes = 0
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.wanted:
+                    self.condition.wait()
+
+                path = self.loading = self.wanted.pop(0)
+
+            image = None
+            try:
+                mtime = os.stat(path).st_mtime_ns
+                image = self.load(path)
+            except Exception as error:
+                print(f"Failed to prefetch {path}: {error}")
+
+            with self.condition:
+                self.loading = None
+                if image is not None:
+                    self.put(path, mtime, image)
+
+                self.condition.notify_all()
+
+
+class BatchStreamer:
+    # serves a remote batch without downloading it: the listing first, then the current image on demand
+    # and a lookahead window in navigation order, each image together with its label
+    def __init__(self, url, container, code, container_dir, batch, label_sync, extension, on_listed, on_fetched, concurrency=STREAM_CONCURRENCY):
+        self.url = url
+        self.container = container
+        self.code = code
+        self.containerDir = container_dir
+        self.folder = f"batches/{batch}"
+        self.batchDir = os.path.join(container_dir, 'batches', batch)
+        self.labelSync = label_sync
+        self.extension = extension
+        self.onListed = on_listed
+        self.onFetched = on_fetched
+        self.concurrency = concurrency
+        # shared with download_folder, so a later full sync skips what was streamed
+        self.manifestPath = get_manifest_path(container_dir, self.folder)
+        self.manifest = load_manifest(self.manifestPath)
+        self.manifestChanged = False
+        self.blobs = {}
+        self.wanted = []
+        self.fetching = set()
+        self.fetched = set()
+        self.stopped = False
+        self.condition = threading.Condition()
+
+    def start(self):
+        threading.Thread(target=self.list_batch, daemon=True).start()
+
+    def list_batch(self):
+        prefix = f"{self.folder}/"
+        names = []
+        try:
+            for kind, blob in iter_blob_listing(self.url, self.container, self.code, prefix):
+                if kind != 'blob':
+                    continue
+
+                self.blobs[blob['name']] = blob
+                relative = blob['name'][len(prefix):]
+                if '/' not in relative and relative.endswith(f".{self.extension}"):
+                    names.append(os.path.splitext(relative)[0])
+        except Exception as error:
+            print(f"An error occurred: {error}")
+            names = []
+
+        self.onListed(self, names)
+        if names and not self.stopped:
+            get_session(self.concurrency)
+            for _ in range(self.concurrency):
+                threading.Thread(target=self.run, daemon=True).start()
+
+    def want(self, names):
+        # replaces what is still waiting, the first name is fetched first
+        with self.condition:
+            self.wanted = [name for name in names if name not in self.fetched and name not in self.fetching]
+            self.condition.notify_all()
+
+    def is_fetched(self, name):
+        return name in self.fetched
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.wanted = []
+            self.condition.notify_all()
+
+        self.save()
+
+    def save(self):
+        with self.condition:
+            if not self.manifestChanged:
+                return
+
+            manifest = dict(self.manifest)
+            self.manifestChanged = False
+
+        save_manifest(self.manifestPath, manifest)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.wanted and not self.stopped:
+                    self.condition.wait()
+
+                if self.stopped:
+                    return
+
+                name = self.wanted.pop(0)
+                self.fetching.add(name)
+
+            fetched = False
+            try:
+                fetched = self.fetch(name)
+            except Exception as error:
+                print(f"An error occurred: {error}")
+
+            with self.condition:
+                self.fetching.discard(name)
+                if fetched:
+                    self.fetched.add(name)
+
+                idle = not self.wanted and not self.fetching
+
+            if idle:
+                self.save()
+
+            self.onFetched(self, name, fetched)
+
+    def fetch_blob(self, blob):
+        local_path = os.path.join(self.containerDir, blob['name'])
+        if is_blob_up_to_date(blob, local_path, self.manifest):
+            return True
+
+        if download_blob(f"{self.url}{self.container}/{blob['name']}?{self.code}", local_path, True, None, blob['size'], blob.get('content_md5'), blob['etag']) is None:
+            return False
+
+        with self.condition:
+            self.manifest[blob['name']] = get_manifest_entry(blob)
+            self.manifestChanged = True
+
+        return True
+
+    def fetch(self, name):
+        # the label is in place before the image is shown, so a server label is never replaced by a prediction
+        label_name = f"{name}.txt"
+        label_blob = self.blobs.get(f"{self.folder}/labels/{label_name}")
+        if label_blob is not None:
+            local_label = os.path.join(self.batchDir, 'labels', label_name)
+            # local edits that were not uploaded yet win over the server copy
+            edited = os.path.isfile(local_label) and self.labelSync.uploaded.get(label_name) != self.labelSync.current_hash(label_name)
+            if not edited:
+                if not self.fetch_blob(label_blob):
+                    return False
+
+                self.labelSync.mark_downloaded([label_name])
+
+        image_blob = self.blobs.get(f"{self.folder}/{name}.{self.extension}")
+        return image_blob is not None and self.fetch_blob(image_blob)
+
+
+class LabelWriter(threading.Thread):
+    # writes label files behind the annotator: the latest content of a file is written once its edits settled,
+    # atomically and only when it changed, and sits in a journal until then so a crash doesn't lose it
+    def __init__(self, journal_path, delay=LABEL_WRITE_DELAY_MS / 1000):
+        super().__init__(daemon=True)
+        self.journalPath = journal_path
+        self.delay = delay
+        self.pending = {}
+        self.requested = {}
+        self.journalQueue = []
+        self.writing = 0
+        self.flushing = 0
+        self.failed = False
+        self.condition = threading.Condition()
+
+    def recover(self):
+        # edits of the last session that were journaled but maybe never written, the last entry of a file wins
+        if not os.path.exists(self.journalPath):
+            return 0
+
+        entries = {}
+        with open(self.journalPath, 'r') as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # torn by the crash
+                    continue
+
+                entries[entry['path']] = entry['content']
+
+        recovered = 0
+        for path, content in entries.items():
+            if not os.path.isdir(os.path.dirname(path)):
+                continue
+
+            try:
+                with open(path, 'r') as file:
+                    current = file.read()
+            except OSError:
+                current = None
+
+            if current != content:
+                write_file_atomic(path, content)
+                recovered += 1
+
+        os.remove(self.journalPath)
+        return recovered
+
+    def remember(self, path, content):
+        # what the file on disk holds, so saving it unchanged is skipped
+        with self.condition:
+            if path not in self.pending:
+                self.requested[path] = None if content is None else hash_bytes(content.encode('utf-8'))
+
+    def pending_content(self, path):
+        with self.condition:
+            entry = self.pending.get(path)
+            return entry[0] if entry is not None else None
+
+    def pending_paths(self):
+        with self.condition:
+            return list(self.pending)
+
+    def write(self, path, content, on_written=None):
+        # returns False when the file already holds or is about to hold this content
+        content_hash = hash_bytes(content.encode('utf-8'))
+        with self.condition:
+            if self.requested.get(path) == content_hash:
+                return False
+
+            self.requested[path] = content_hash
+            self.pending[path] = (content, on_written, time.monotonic())
+            self.journalQueue.append({'path': path, 'content': content})
+            self.condition.notify_all()
+
+        return True
+
+    def flush(self):
+        # blocks until everything requested so far is on disk
+        with self.condition:
+            self.flushing += 1
+            self.condition.notify_all()
+            while self.pending or self.journalQueue or self.writing:
+                self.condition.wait()
+
+            self.flushing -= 1
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.journalQueue:
+                    self.condition.wait()
+
+                journal, self.journalQueue = self.journalQueue, []
+
+            # the journal is appended right away, only the label files wait for the edits to settle
+            if journal:
+                self.append_journal(journal)
+
+            with self.condition:
+                now = time.monotonic()
+                due = [path for path, (_, _, requested) in self.pending.items() if self.flushing or now - requested >= self.delay]
+                if not due:
+                    if self.pending and not self.journalQueue:
+                        self.condition.wait(self.delay - (now - min(requested for _, _, requested in self.pending.values())))
+
+                    continue
+
+                writes = [(path, self.pending.pop(path)) for path in due]
+                self.writing += 1
+
+            for path, (content, on_written, _) in writes:
+                self.write_label(path, content, on_written)
+
+            with self.condition:
+                self.writing -= 1
+                if not self.pending and not self.journalQueue and not self.failed:
+                    self.clear_journal()
+
+                self.condition.notify_all()
+
+    def write_label(self, path, content, on_written):
+        try:
+            write_file_atomic(path, content)
+        except OSError as error:
+            # kept in the journal, the next start tries again
+            print(f"Failed to save labels {path}: {error}")
+            self.failed = True
+            with self.condition:
+                self.requested.pop(path, None)
+
+            return
+
+        if on_written is not None:
+            try:
+                on_written(path)
+            except Exception as error:
+                print(f"An error occurred: {error}")
+
+    def append_journal(self, entries):
+        try:
+            with open(self.journalPath, 'a') as file:
+                file.write(''.join(json.dumps(entry) + '\n' for entry in entries))
+        except OSError as error:
+            print(f"Failed to journal labels: {error}")
+
+    def clear_journal(self):
+        try:
+            if os.path.exists(self.journalPath):
+                os.remove(self.journalPath)
+        except OSError as error:
+            print(f"Failed to clear the label journal: {error}")
+
+
+class Box:
+    __slots__ = ('x1', 'y1', 'x2', 'y2', 'classIndex', 'canvasId')
+
+    def __init__(self, x1, y1, x2, y2, class_index):
+        self.x1 = x1
+        self.y1 = y1
+        self.x2 = x2
+        self.y2 = y2
+        self.classIndex = class_index
+        self.canvasId = None
+
+
+class BoxStore:
+    # boxes of the current image, the annotations Listbox is only a view of it
+    def __init__(self):
+        self.boxes = []
+        self.selected = -1
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __iter__(self):
+        return iter(self.boxes)
+
+    def __getitem__(self, index):
+        return self.boxes[index]
+
+    def add(self, x1, y1, x2, y2, class_index):
+        self.boxes.append(Box(x1, y1, x2, y2, class_index))
+        return len(self.boxes) - 1
+
+    def remove(self, index):
+        box = self.boxes.pop(index)
+        if self.selected >= len(self.boxes):
+            self.selected = 0 if self.boxes else -1
+
+        return box
+
+    def clear(self):
+        boxes = self.boxes
+        self.boxes = []
+        self.selected = -1
+        return boxes
+
+    def selected_box(self):
+        if 0 <= self.selected < len(self.boxes):
+            return self.boxes[self.selected]
+
+        return None
+
+
+def get_color(class_index):
+    return COLORS[class_index % len(COLORS)]
 
 
 class LabelTool:
-    def __init__(self, master):
+    def __init__(self, master, data_dir=None):
         # set up the main frame
         self.rootPanel = master
         self.rootPanel.title("AZ Vision - Trainer")
         self.rootPanel.resizable(width=False, height=False)
 
         self.baseDir = os.path.dirname(os.path.dirname(__file__))
-        self.dataDir = os.path.join(self.baseDir, 'data')
+        self.dataDir = data_dir or os.path.join(self.baseDir, 'data')
         self.this_repo = str(pathlib.Path(__file__).parent.resolve().parent)
         self.configFile = os.path.join(self.dataDir, 'config', 'config.yml')
 
         # initialize global state
-        self.config = {'url': "", 'container': "", 'code': "", 'next_box_after_class_set': True}
-        if os.path.exists(self.configFile):
-            with open(self.configFile, 'r') as file:
-                loaded_config = yaml.safe_load(file)
-                if loaded_config is not None:
-                    self.config = loaded_config
-
-            file.close()
+        self.config = load_config(self.configFile)
 
         self.containerDir = os.path.join(self.dataDir, self.config['container'])
         self.modelDir = os.path.join(self.containerDir, 'models')
         self.batchDir = os.path.join(self.containerDir, 'batches')
 
+        # network and model loading run one job at a time off the Tk thread, results come back through uiQueue
+        self.backgroundJobs = queue.Queue()
+        self.uiQueue = queue.Queue()
+        # daemon, so closing the window doesn't wait for a running download
+        threading.Thread(target=self.run_background_jobs, daemon=True).start()
+        # batch downloads and label uploads, shown in the transfer panel while labeling goes on
+        self.transfers = TransferManager()
+        self.transferSeen = (None, 0)
+        # downloaded images of the open batch still waiting for their label
+        self.heldImages = []
+        self.diskCache = DiskCache(self.containerDir)
+
+        # label files are written behind the annotator, edits a crash cut off are put back before anything is loaded
+        self.labelWriter = LabelWriter(os.path.join(self.dataDir, '.label_journal.jsonl'))
+        recovered = self.labelWriter.recover()
+        if recovered:
+            print(f"Recovered {recovered} label files that were not saved when the trainer last stopped")
+
+        self.labelWriter.start()
+
         self.model = None
+        self.modelHash = None
+        self.modelCache = ModelCache()
+        self.modelLock = threading.Lock()
+        self.predictionCache = None
+        self.preAnnotator = None
+        self.imageHashes = {}
+        self.prefetcher = ImagePrefetcher(load_display_image)
+        self.streamer = None
+        self.waitingFor = None
+        self.navigationStep = 1
+        self.pendingLoad = None
         self.currentBatchDir = ''
         self.imageList = []
         self.cur = 0
         self.total = 0
         self.imgRootName = None
         self.imageName = ''
-        self.batchList = list_folders_in_folder_azure(self.config['url'], self.config['container'], self.config['code'], "batches")
+        self.batchList = self.load_cached_batch_list()
         self.labelsDir = None
+        self.labelSync = None
+        self.batchIndex = None
         self.labelFileName = ''
         self.tkimg = None
         self.currentLabelClass = ''
         self.classesList = {0: "generic"}
+        self.classIndexes = {"generic": 0}
         self.yolo_prediction_classes = {0: "generic"}
 
         self.fileNameExt = "jpg"
-        self.selectedBbox = 0
+        self.boxStore = BoxStore()
 
         # initialize mouse state
         self.STATE = {}
 
         # reference to bbox
         self.bboxIdList = []
-        self.curBBoxId = None
-        self.horizontalLine = None
-        self.verticalLine = None
+        self.pointer = None
+        self.pendingPointerDraw = None
+        self.crosshairShown = False
 
         # ----------------- GUI stuff ---------------------
 
@@ -336,12 +2620,33 @@ class LabelTool:
 
         self.batchSelector.bind("<<ComboboxSelected>>", self.batch_select)
 
+        stream_text = 'Stream batch: ON' if self.config['stream_batches'] else 'Stream batch: OFF'
+        self.bStreamBatches = Button(batch_frame, text=stream_text, command=self.toggle_stream_batches)
+        self.bStreamBatches.pack(side=LEFT, padx=5)
         Button(batch_frame, text="Download batch from server", command=self.batch_download_select).pack(side=LEFT, padx=5)
         Button(batch_frame, text="Upload labels to server", command=self.upload_labels).pack(side=LEFT, padx=5)
+        Button(batch_frame, text="Disk cache", command=self.show_cache_report).pack(side=LEFT, padx=5)
+        Button(batch_frame, text="Timings", command=self.show_timings).pack(side=LEFT, padx=5)
+
+        self.statusLabel = Label(batch_frame, text="")
+        self.statusLabel.pack(side=LEFT, padx=5)
+
+        # transfers
+        transfer_frame = Frame(self.ctrTopPanel)
+        transfer_frame.grid(row=1, column=0, sticky=W + N)
+
+        self.transferLabel = Label(transfer_frame, text="No transfers", width=30, anchor=W)
+        self.transferLabel.pack(side=LEFT, padx=5)
+        self.transferProgress = ttk.Progressbar(transfer_frame, length=200, mode='determinate')
+        self.transferProgress.pack(side=LEFT, padx=5)
+        self.transferStatsLabel = Label(transfer_frame, text="")
+        self.transferStatsLabel.pack(side=LEFT, padx=5)
+        self.transferCancelButton = Button(transfer_frame, text="Cancel transfer", command=self.cancel_transfer, state='disabled')
+        self.transferCancelButton.pack(side=LEFT, padx=5)
 
         # image info
         image_frame = Frame(self.ctrTopPanel)
-        image_frame.grid(row=1, column=0, sticky=W)
+        image_frame.grid(row=2, column=0, sticky=W)
 
         # current file info
         self.lblFilename = Label(image_frame, text="Filename")
@@ -352,6 +2657,12 @@ class LabelTool:
         self.mainPanel.grid(row=1, column=0, sticky=W + N)
         self.mainPanel.bind("<Button-1>", self.mouse_click)
         self.mainPanel.bind("<Motion>", self.mouse_move)
+        # the one and only background item, every image swap just reconfigures it
+        self.backgroundId = self.mainPanel.create_image(0, 0, anchor=N + W)
+        # crosshair and rubber band are long-lived items that are only moved around
+        self.horizontalLine = self.mainPanel.create_line(0, 0, 0, 0, width=2, state='hidden', tags='overlay')
+        self.verticalLine = self.mainPanel.create_line(0, 0, 0, 0, width=2, state='hidden', tags='overlay')
+        self.curBBoxId = self.mainPanel.create_rectangle(0, 0, 0, 0, width=2, state='hidden', tags='overlay')
 
         self.rootPanel.bind("<Escape>", self.cancel_bbox)  # press Escape to cancel current bbox
         self.rootPanel.bind("c", self.cancel_bbox)  # press 'c' to cancel creation
@@ -383,7 +2694,7 @@ class LabelTool:
         Label(self.ctrClassPanel, text='Annotations:').grid(row=4, column=0, sticky=W + N)
         Button(self.ctrClassPanel, text='Delete Selected (z)', command=self.del_bbox).grid(row=5, column=0, sticky=W + N + S)
         Button(self.ctrClassPanel, text='Delete All (x)', command=self.del_all_bboxes).grid(row=6, column=0, sticky=W + N + S)
-        self.annotationsList = Listbox(self.ctrClassPanel, width=80, height=12, selectmode="SINGLE", activestyle="none")
+        self.annotationsList = Listbox(self.ctrClassPanel, width=80, height=12, selectmode="SINGLE", activestyle="none", exportselection=False)
         self.annotationsList.grid(row=7, column=0, columnspan=2, sticky=N + S + W)
         self.annotationsList.bind("<<ListboxSelect>>", self.on_listbox_select)
         self.annotationsList.bind("<Up>", self.arrow_up)
@@ -426,6 +2737,11 @@ class LabelTool:
         self.progLabel.pack(padx=5)
         self.nextBtn = Button(self.ctrNavigatePanel, text='(d) Next >>', width=10, command=self.next_image)
         self.nextBtn.pack(padx=5, pady=3)
+        Button(self.ctrNavigatePanel, text='(n) Next unlabeled', command=self.next_unlabeled).pack(padx=5, pady=3)
+        Button(self.ctrNavigatePanel, text='Next with selected class', command=self.next_with_class).pack(padx=5, pady=3)
+        self.statsLabel = Label(self.ctrNavigatePanel, text='', justify=LEFT, wraplength=250)
+        self.statsLabel.pack(padx=5)
+        self.rootPanel.bind("n", self.next_unlabeled)  # press 'n' to go to the next image without labels
 
         # display mouse position
         self.disp = Label(self.ctrNavigatePanel, text='Mouse location')
@@ -435,10 +2751,19 @@ class LabelTool:
 
         #  loading
 
-        self.reload_model()
+        # the window comes up from what is on disk, the network and the model catch up in the background
+        self.timingsWindow = None
+        self.rootPanel.protocol("WM_DELETE_WINDOW", self.close)
+
+        self.poll_ui_queue()
+        self.update_transfer_panel()
+        self.load_classes()
         self.batch_select()
+        self.start_background_loading(True)
 
     def save_config(self):
+        import yaml
+
         try:
             os.makedirs(os.path.dirname(self.configFile), exist_ok=True)
             with open(self.configFile, 'w') as file:
@@ -468,9 +2793,9 @@ class LabelTool:
         return
 
     def apply_code(self, new_code):
-        url_search = re.search(r"(https://[^/]+/)", new_code)
+        url_search = re.search(r"(https?://[^/]+/)", new_code)
         self.config['url'] = url_search.group(1) if url_search else ""
-        container_search = re.search(r"https://[^/]+/([^?]+)\?sv=", new_code)
+        container_search = re.search(r"https?://[^/]+/([^?]+)\?sv=", new_code)
         self.config['container'] = container_search.group(1) if container_search else ""
         code_search = re.search(r"\?sv=(.+)", new_code)
         self.config['code'] = "sv=" + code_search.group(1) if code_search else ""
@@ -478,21 +2803,198 @@ class LabelTool:
         self.containerDir = os.path.join(self.dataDir, self.config['container'])
         self.modelDir = os.path.join(self.containerDir, 'models')
         self.batchDir = os.path.join(self.containerDir, 'batches')
+        self.diskCache = DiskCache(self.containerDir)
         self.unload(True)
-        self.batchList = list_folders_in_folder_azure(self.config['url'], self.config['container'], self.config['code'], "batches")
+        self.batchList = self.load_cached_batch_list()
         if len(self.batchList) > 0:
             self.batchSelector['values'] = self.batchList
             self.batchSelector.current(0)
 
+        self.start_background_loading(True)
+
+    def close(self):
+        # the spans of the session are kept next to the data when the window closes
+        self.labelWriter.flush()
+        self.export_timings()
+        self.rootPanel.destroy()
+
+    def export_timings(self):
+        path = timings.export(os.path.join(self.dataDir, 'timings'))
+        if path:
+            print(f"Timings exported to {path}.json and {path}.csv")
+
+        return path
+
+    def show_timings(self):
+        if self.timingsWindow is not None and self.timingsWindow.winfo_exists():
+            self.timingsWindow.lift()
+            return
+
+        timings.enabled = True
+        self.timingsWindow = Toplevel(self.rootPanel)
+        self.timingsWindow.title("Timings")
+        self.timingsLabel = Label(self.timingsWindow, text="", font='TkFixedFont', justify=LEFT, anchor=W)
+        self.timingsLabel.pack(padx=5, pady=5, anchor=W)
+        button_frame = Frame(self.timingsWindow)
+        button_frame.pack(pady=5)
+        self.bTimingsEnabled = Button(button_frame, text='Recording: ON', command=self.toggle_timings)
+        self.bTimingsEnabled.pack(side=LEFT, padx=5)
+        Button(button_frame, text="Export JSON/CSV", command=self.export_timings).pack(side=LEFT, padx=5)
+        self.refresh_timings()
+
+    def toggle_timings(self):
+        timings.enabled = not timings.enabled
+        self.bTimingsEnabled.config(text='Recording: ON' if timings.enabled else 'Recording: OFF')
+
+    def refresh_timings(self):
+        if self.timingsWindow is None or not self.timingsWindow.winfo_exists():
+            self.timingsWindow = None
+            return
+
+        self.timingsLabel.config(text=timings.summary_string())
+        self.rootPanel.after(TIMINGS_REFRESH_MS, self.refresh_timings)
+
+    def run_on_ui(self, callback):
+        # the only way for a background thread to touch Tk
+        self.uiQueue.put(callback)
+
+    def poll_ui_queue(self):
+        while True:
+            try:
+                callback = self.uiQueue.get_nowait()
+            except queue.Empty:
+                break
+
+            try:
+                callback()
+            except Exception as error:
+                print(f"An error occurred: {error}")
+
+        self.rootPanel.after(UI_POLL_MS, self.poll_ui_queue)
+
+    def set_status(self, text):
+        self.run_on_ui(lambda: self.statusLabel.config(text=text))
+
+    def get_batch_list_path(self):
+        return os.path.join(self.containerDir, '.manifests', 'batch_list.json')
+
+    def load_cached_batch_list(self):
+        batch_list = load_manifest(self.get_batch_list_path()) or {}
+        cached = batch_list.get('batches', [])
+        local = list_folders_in_folder(self.batchDir) if os.path.isdir(self.batchDir) else []
+        return cached + [batch for batch in sorted(local) if batch not in cached]
+
+    def start_background_loading(self, load_local_model=False):
+        url, container, code = self.config['url'], self.config['container'], self.config['code']
+        self.backgroundJobs.put(lambda container_dir=self.containerDir: self.background_loading(url, container, code, container_dir, load_local_model))
+
+    def run_background_jobs(self):
+        while True:
+            job = self.backgroundJobs.get()
+            try:
+                job()
+            except Exception as error:
+                print(f"An error occurred: {error}")
+
+    def background_loading(self, url, container, code, container_dir, load_local_model):
+        model_dir = os.path.join(container_dir, 'models')
+        try:
+            if load_local_model:
+                self.set_status("Loading model...")
+                loaded = self.build_model(container_dir)
+                self.run_on_ui(lambda loaded=loaded: self.apply_model(model_dir, loaded))
+
+            self.set_status("Refreshing batch list...")
+            try:
+                batch_list = list_folders_in_folder_azure(url, container, code, "batches")
+            except Exception as error:
+                # the cached list stays, models are still synced
+                print(f"Could not refresh the batch list: {describe_error(error)}")
+                batch_list = []
+
+            if batch_list:
+                save_manifest(os.path.join(container_dir, '.manifests', 'batch_list.json'), {'batches': batch_list})
+                self.run_on_ui(lambda: self.apply_batch_list(container_dir, batch_list))
+
+            self.set_status("Syncing models...")
+            download_folder(url, container, code, 'models', container_dir, self.config['transfer_concurrency'], True)
+
+            self.set_status("Loading model...")
+            loaded = self.build_model(container_dir)
+            self.run_on_ui(lambda loaded=loaded: self.apply_model(model_dir, loaded))
+
+            if self.config['cache_budget_gb']:
+                self.set_status("Checking disk cache...")
+                evicted, total = DiskCache(container_dir).evict(self.config['cache_budget_gb'] * 1e9, self.get_open_cache_keys())
+                if evicted:
+                    print(f"Evicted {len(evicted)} entries from the disk cache, {total / 1e9:.2f} GB left")
+                    self.run_on_ui(lambda: self.apply_batch_list(container_dir, []))
+
+            self.set_status("Ready")
+        except Exception as error:
+            print(f"An error occurred: {error}")
+            self.set_status("Loading failed, see console")
+
+    def get_open_cache_keys(self):
+        # the open batch and those a transfer job is still downloading into
+        batches = [job.batch for job in [self.transfers.current] + self.transfers.pending() if job is not None and job.batch]
+        if self.currentBatchDir:
+            batches.append(self.currentBatchDir)
+
+        return {f"batches/{os.path.basename(batch)}" for batch in batches}
+
+    def show_cache_report(self):
+        # sizing the cache walks every batch, it runs with the other background jobs
+        budget = self.config['cache_budget_gb'] * 1e9
+        disk_cache, keep = self.diskCache, self.get_open_cache_keys()
+        self.set_status("Measuring disk cache...")
+        self.backgroundJobs.put(lambda: self.run_on_ui(lambda report=disk_cache.report(budget, keep): self.open_cache_report(report)))
+
+    def open_cache_report(self, report):
+        self.set_status("")
+        window = Toplevel(self.rootPanel)
+        window.title("Disk cache")
+        Label(window, text=report, font='TkFixedFont', justify=LEFT, anchor=W).pack(padx=5, pady=5, anchor=W)
+        if self.config['cache_budget_gb']:
+            Button(window, text="Evict to budget", command=lambda: [window.destroy(), self.evict_cache()]).pack(pady=5)
+
+    def evict_cache(self):
+        budget = self.config['cache_budget_gb'] * 1e9
+        disk_cache, keep, container_dir = self.diskCache, self.get_open_cache_keys(), self.containerDir
+
+        def evict():
+            evicted, total = disk_cache.evict(budget, keep)
+            self.set_status(f"Evicted {len(evicted)} entries, {total / 1e9:.2f} GB in cache")
+            self.run_on_ui(lambda: self.apply_batch_list(container_dir, []))
+
+        self.backgroundJobs.put(evict)
+
+    def apply_batch_list(self, container_dir, batch_list):
+        if container_dir != self.containerDir:
+            return
+
+        current = self.currentBatchDir and os.path.basename(self.currentBatchDir)
+        self.batchList = batch_list + [batch for batch in self.load_cached_batch_list() if batch not in batch_list]
+        self.batchSelector['values'] = self.batchList
+        if current in self.batchList:
+            self.batchSelector.current(self.batchList.index(current))
+        else:
+            self.batchSelector.current(0)
+            if not self.currentBatchDir:
+                self.batch_select()
+
     def unload(self, full=False):
+        self.stop_preannotation()
+        if self.streamer is not None:
+            self.streamer.stop()
+            self.streamer = None
+
+        self.waitingFor = None
+        self.prefetcher.clear()
         self.del_all_bboxes()
-        self.mainPanel.delete(self.tkimg)
-        self.selectedBbox = 0
-        self.STATE = {}
+        self.mainPanel.itemconfig(self.backgroundId, image='')
+        self.cancel_bbox()
         self.bboxIdList = []
-        self.curBBoxId = None
-        self.horizontalLine = None
-        self.verticalLine = None
         self.currentBatchDir = ''
         self.imageList = []
         self.cur = 0
@@ -505,27 +3007,59 @@ class LabelTool:
             self.batchSelector['values'] = [""]
             self.batchSelector.current(0)
 
+        # labels of the batch that are still being written land before its index closes
+        self.labelWriter.flush()
         self.labelsDir = None
+        self.labelSync = None
+        if self.batchIndex is not None:
+            self.batchIndex.close()
+            self.batchIndex = None
+
+        self.statsLabel.config(text='')
         self.labelFileName = ''
         self.tkimg = None
 
     def reload_model(self, event=None):
-        download_folder(self.config['url'], self.config['container'], self.config['code'], 'models', self.containerDir)
-        self.load_model()
-
-    def load_model(self):
-        # Get a list of all .pt files in modelDir
-        pt_files = glob.glob(os.path.join(self.modelDir, '*.pt'))
-
-        # Check if there are any .pt files
-        if pt_files:
-            # Get the latest .pt file based on modification time
-            latest_file = max(pt_files, key=os.path.getmtime)
-            self.model = YOLO(latest_file)
-        else:
-            self.model = None
+        self.start_background_loading()
 
+    def build_model(self, container_dir):
+        # runs on a background thread and must not touch Tk
+        latest_file = find_latest_model(os.path.join(container_dir, 'models'))
+        if latest_file is None:
+            return None
+
+        DiskCache(container_dir).touch(f"models/{os.path.basename(latest_file)}")
+        model_hash, model = self.modelCache.get(latest_file, get_inference_options(self.config))
+        if model_hash == self.modelHash:
+            return self.model, self.modelHash, self.predictionCache
+
+        return model, model_hash, PredictionCache(os.path.join(container_dir, 'predictions'), model_hash)
+
+    def apply_model(self, model_dir, loaded):
+        if model_dir != self.modelDir or (loaded is not None and loaded[1] == self.modelHash):
+            # a model of a container that is no longer open, or the one already in use
+            if loaded is not None and loaded[2] is not self.predictionCache:
+                loaded[2].close()
+
+            return
+
+        self.stop_preannotation()
+        if self.predictionCache is not None:
+            self.predictionCache.close()
+
+        self.model, self.modelHash, self.predictionCache = loaded if loaded is not None else (None, None, None)
+        self.load_classes()
+
+        if self.currentBatchDir:
+            self.start_preannotation()
+
+            # the image on screen was shown before the model was ready
+            if self.imageList and len(self.boxStore) == 0 and not self.has_label_file(self.imgRootName):
+                self.load_image()
+
+    def load_classes(self):
         self.classesList = self.load_classes_from_file('names')
+        self.classIndexes = {class_name: class_id for class_id, class_name in self.classesList.items()}
         self.yolo_prediction_classes = self.load_classes_from_file('az_trainer_prediction')
 
         numbered_classes_list = []
@@ -537,55 +3071,256 @@ class LabelTool:
         self.class_on_create()
         self.classCandidate.bind("<<ComboboxSelected>>", self.class_on_create)
 
+    def get_image_hash(self, image_path):
+        stat = os.stat(image_path)
+        key = (image_path, stat.st_size, stat.st_mtime_ns)
+        image_hash = self.imageHashes.get(key)
+        if image_hash is None:
+            image_hash = self.imageHashes[key] = hash_file(image_path)
+
+        return image_hash
+
+    def start_preannotation(self):
+        self.stop_preannotation()
+        if self.model is None or not self.imageList:
+            return
+
+        # unlabeled images in navigation order, starting from the current one
+        ordered = self.imageList[self.cur - 1:] + self.imageList[:self.cur - 1]
+        image_paths = []
+        for image_name in ordered:
+            image_path = os.path.join(self.currentBatchDir, f"{image_name}.{self.fileNameExt}")
+            # a streamed batch only has some of its images on disk
+            if os.path.exists(image_path) and not self.has_label_file(image_name):
+                image_paths.append(image_path)
+
+        if not image_paths:
+            return
+
+        self.preAnnotator = PreAnnotator(self.model, self.modelLock, self.predictionCache, image_paths, self.get_image_hash)
+        self.preAnnotator.start()
+
+    def queue_preannotation(self, name):
+        # a streamed image that just landed, predicted off the Tk thread before the annotator gets to it
+        if self.model is None or self.has_label_file(name):
+            return
+
+        image_path = os.path.join(self.currentBatchDir, f"{name}.{self.fileNameExt}")
+        if self.preAnnotator is None:
+            self.preAnnotator = PreAnnotator(self.model, self.modelLock, self.predictionCache, [image_path], self.get_image_hash)
+            self.preAnnotator.start()
+        else:
+            self.preAnnotator.add([image_path])
+
+    def stop_preannotation(self):
+        if self.preAnnotator is not None:
+            self.preAnnotator.stop()
+            self.preAnnotator = None
+
     def load_classes_from_file(self, key):
-        classes_file = os.path.join(self.modelDir, 'data.yaml')
-        classes_dict = {0: "generic"}  # Initialize with 'generic' at index 0
-
-        if not os.path.exists(classes_file):
-            return classes_dict
-        
-        with open(classes_file, 'r') as file:
-            data = yaml.safe_load(file)
-            # Extract the values from the 'names' dictionary and sort by the key to ensure the order
-            classes_dict.update(data.get(key, {}))
-        
-        return classes_dict
+        return load_classes_from_file(self.modelDir, key)
 
     def batch_download_select(self, event=None):
         self.download_batch()
         self.batch_select()
 
-    def batch_select(self, event=None):
+    def get_selected_batch(self):
         index = self.batchSelector.current()
         if index < 0 or index >= len(self.batchList):
-            return
+            return None
 
-        batch = self.batchList[index]
+        return self.batchList[index] or None
 
+    def batch_select(self, event=None):
+        batch = self.get_selected_batch()
         if not batch:
             return
 
         self.unload()
-        self.load_dir(os.path.join(self.batchDir, batch))
+        if self.config['stream_batches'] and self.config['code']:
+            self.stream_batch(batch)
+        else:
+            self.load_batch_dir(os.path.join(self.batchDir, batch))
+
+    def load_batch_dir(self, batch_dir):
+        # while the batch downloads, or waits to, the images on disk whose label is not there yet wait with the ones
+        # still arriving, nothing is shown before the job started and its listing is through
+        job = self.transfers.find(batch_dir)
+        if job is None:
+            self.load_dir(batch_dir)
+            return
 
-    def download_batch(self, event=None):
-        index = self.batchSelector.current()
-        if index < 0 or index >= len(self.batchList):
+        seen = len(job.stats.completed)
+        self.load_dir(batch_dir, self.get_downloaded_image_check(job))
+        if self.currentBatchDir == batch_dir and self.batchIndex is not None:
+            shown = set(self.imageList)
+            self.transferSeen = (job, seen)
+            self.heldImages = [name for name in self.batchIndex.names() if name not in shown]
+
+    def toggle_stream_batches(self):
+        self.config['stream_batches'] = not self.config['stream_batches']
+        self.bStreamBatches.config(text='Stream batch: ON' if self.config['stream_batches'] else 'Stream batch: OFF')
+        self.save_config()
+
+    def stream_batch(self, batch):
+        # only the listing is needed to start, images are fetched as the annotator gets to them
+        self.currentBatchDir = os.path.join(self.batchDir, batch)
+        self.labelsDir = os.path.join(self.currentBatchDir, 'labels')
+        os.makedirs(self.labelsDir, exist_ok=True)
+        self.labelSync = LabelSyncState(self.currentBatchDir)
+        self.diskCache.touch(f"batches/{batch}")
+        self.batchIndex = BatchIndex(self.currentBatchDir, self.fileNameExt)
+        self.update_stats()
+
+        def on_listed(streamer, names):
+            self.run_on_ui(lambda: self.apply_stream_listing(streamer, names))
+
+        def on_fetched(streamer, name, fetched):
+            self.run_on_ui(lambda: self.apply_streamed_image(streamer, name, fetched))
+
+        self.streamer = BatchStreamer(self.config['url'], self.config['container'], self.config['code'], self.containerDir, batch, self.labelSync, self.fileNameExt, on_listed, on_fetched)
+        self.streamer.start()
+        self.lblFilename.config(text=f"Listing batch {batch}...")
+
+    def apply_stream_listing(self, streamer, names):
+        if streamer is not self.streamer:
             return
 
-        batch = self.batchList[index]
+        if not names:
+            # offline, or nothing on the server, what is on disk is all there is
+            print(f"Nothing to stream, opening {self.currentBatchDir} from disk")
+            batch_dir = self.currentBatchDir
+            self.unload()
+            self.load_batch_dir(batch_dir)
+            return
 
-        if not batch:
+        self.imageList = names
+        self.cur = 1
+        self.total = len(self.imageList)
+        self.load_image()
+        self.annotationsList.focus_set()
+
+    def apply_streamed_image(self, streamer, name, fetched):
+        if streamer is not self.streamer:
             return
 
-        thread = threading.Thread(target=download_folder, args=(self.config['url'], self.config['container'], self.config['code'], f"batches/{batch}", self.containerDir))
-        thread.start()
+        if name != self.waitingFor:
+            # a lookahead image landed, it can be decoded and predicted ahead now
+            if fetched:
+                self.queue_preannotation(name)
+
+            if self.imgRootName:
+                self.prefetch_neighbours()
 
-        messagebox.showinfo("Batch", message=f"Downloading batch {batch}...\n\nProgress bar is in the command line.")
+            return
 
-        thread.join()
+        if not fetched:
+            self.lblFilename.config(text=f"Filename: {name} (fetch failed, navigate back to retry)")
+            return
 
-        return
+        if self.imageList[self.cur - 1] == name:
+            self.load_image()
+
+    def stream_neighbours(self):
+        # the current image first, then the ones the annotator is heading to, then a few behind
+        index = self.cur - 1
+        names = [self.imageList[index]]
+        for distance in range(1, STREAM_LOOKAHEAD + 1):
+            ahead = index + self.navigationStep * distance
+            if 0 <= ahead < len(self.imageList):
+                names.append(self.imageList[ahead])
+
+        for distance in range(1, PREFETCH_RADIUS + 1):
+            behind = index - self.navigationStep * distance
+            if 0 <= behind < len(self.imageList):
+                names.append(self.imageList[behind])
+
+        self.streamer.want(names)
+
+    def show_fetching(self):
+        self.waitingFor = self.imageList[self.cur - 1]
+        # nothing is drawn or saved for an image that isn't there yet
+        self.del_all_bboxes()
+        self.cancel_bbox()
+        self.imgRootName = ''
+        self.tkimg = None
+        self.mainPanel.itemconfig(self.backgroundId, image='')
+        self.progLabel.config(text=f"{self.cur}/{self.total}")
+        self.lblFilename.config(text=f"Filename: {self.waitingFor} (fetching...)")
+
+    def download_batch(self, event=None):
+        batch = self.get_selected_batch()
+        if not batch:
+            return
+
+        batch_dir = os.path.join(self.batchDir, batch)
+        job = self.transfers.find(batch_dir)
+        if job is not None:
+            # asking again for a batch that is still waiting moves it to the front
+            self.transfers.prioritize(job)
+            return job
+
+        url, container, code, container_dir = self.config['url'], self.config['container'], self.config['code'], self.containerDir
+        concurrency = self.config['transfer_concurrency']
+
+        label_writer = self.labelWriter
+        labels_prefix = f"batches/{batch}/labels/"
+        job_label_sync = []
+
+        def keep_local(blob_name, local_path):
+            # a label with edits that are not uploaded yet, or still on their way to disk, wins over the server copy
+            if not blob_name.startswith(labels_prefix):
+                return False
+
+            name = blob_name[len(labels_prefix):]
+            if label_writer.pending_content(os.path.join(batch_dir, 'labels', name)) is not None:
+                return True
+
+            if not os.path.isfile(local_path):
+                return False
+
+            label_sync = self.labelSync if self.currentBatchDir == batch_dir and self.labelSync is not None else None
+            if label_sync is None:
+                if not job_label_sync:
+                    job_label_sync.append(LabelSyncState(batch_dir))
+
+                label_sync = job_label_sync[0]
+
+            return label_sync.uploaded.get(name) != label_sync.current_hash(name)
+
+        def run(job):
+            return download_folder(url, container, code, f"batches/{batch}", container_dir, concurrency, True, job.stats, job.cancelled, keep_local)
+
+        return self.transfers.submit(TransferJob(f"Download {batch}", run, PRIORITY_NORMAL, lambda job: self.batch_downloaded(job, batch_dir), batch_dir))
+
+    def batch_downloaded(self, job, batch_dir):
+        # runs on the transfer thread
+        stats = job.result
+        if stats:
+            labels_prefix = f"batches/{os.path.basename(batch_dir)}/labels/"
+            downloaded_labels = [name[len(labels_prefix):] for name in stats.completed if name.startswith(labels_prefix)]
+            if downloaded_labels:
+                label_sync = self.labelSync if self.currentBatchDir == batch_dir and self.labelSync is not None else LabelSyncState(batch_dir)
+                label_sync.mark_downloaded(downloaded_labels)
+
+            if stats.listingError:
+                self.set_status(f"Batch {os.path.basename(batch_dir)} is incomplete, its listing failed, see console")
+            elif stats.failures:
+                self.set_status(f"{len(stats.failures)} files of {os.path.basename(batch_dir)} failed to download, see console")
+
+        self.run_on_ui(lambda: self.apply_downloaded_batch(job))
+
+    def apply_downloaded_batch(self, job):
+        self.show_downloaded_images(job)
+        # the pre-annotator only knew the images that were there when it started
+        if job.batch == self.currentBatchDir:
+            self.start_preannotation()
+            if self.batchIndex is not None and self.streamer is None:
+                self.batchIndex.refresh()
+                threading.Thread(target=self.batchIndex.fill_sizes, daemon=True).start()
+                self.update_stats()
+                # images that were on disk already but held back while the download ran
+                self.add_images(self.batchIndex.names())
 
     def upload_labels(self, event=None):
         if not self.currentBatchDir:
@@ -595,18 +3330,132 @@ class LabelTool:
 
         batch = os.path.basename(self.currentBatchDir)
 
-        res = messagebox.askquestion('Upload labels', 'Warning, all labels from current batch will be uploaded to cloud storage, do you want to proceed?')
+        self.labelWriter.flush()
+        dirty, skipped = self.labelSync.dirty_files()
+        if not dirty:
+            messagebox.showinfo("Labels", message=f"Nothing to upload, all {skipped} label files of batch {batch} are already on the server.")
+            return
+
+        archive = self.config['label_archive_upload']
+        if archive:
+            # the archive always carries every label of the batch, a newer archive replaces the older one
+            hashes = {**dirty, **{name: self.labelSync.current_hash(name) for name in os.listdir(self.labelsDir) if name.endswith('.txt') and name not in dirty}}
+            question = f'Warning, all {len(hashes)} labels ({len(dirty)} changed) from current batch will be uploaded to cloud storage as one archive, do you want to proceed?'
+        else:
+            hashes = dirty
+            question = f'Warning, {len(dirty)} changed labels from current batch will be uploaded to cloud storage ({skipped} unchanged skipped), do you want to proceed?'
+
+        res = messagebox.askquestion('Upload labels', question)
         if res.lower() == 'yes':
-            thread = threading.Thread(target=upload_folder, args=(os.path.join(self.currentBatchDir, 'labels'), self.config['url'], self.config['container'], self.config['code'], f"batches/{batch}/labels"))
-            thread.start()
+            url, container, code, labels_dir = self.config['url'], self.config['container'], self.config['code'], self.labelsDir
+            concurrency = self.config['transfer_concurrency']
+
+            def run(job):
+                if archive:
+                    return upload_archive(labels_dir, url, container, code, f"batches/{batch}/{LABEL_ARCHIVE_NAME}", sorted(hashes), 'labels/', job.stats, job.cancelled)
 
-            messagebox.showinfo("Labels", message=f"Uploading labels from batch {batch}...\n\nProgress bar is in the command line.")
+                return upload_folder(labels_dir, url, container, code, f"batches/{batch}/labels", concurrency, list(dirty), job.stats, job.cancelled)
 
-            thread.join()
+            # uploads are small and protect work, they go before queued downloads
+            self.transfers.submit(TransferJob(f"Upload labels of {batch}", run, PRIORITY_HIGH, lambda job, label_sync=self.labelSync: self.labels_uploaded(job, label_sync, hashes, 0 if archive else skipped)))
 
         return
 
-    def load_dir(self, directory):
+    def labels_uploaded(self, job, label_sync, hashes, skipped):
+        # runs on the transfer thread
+        stats = job.result
+        if stats:
+            label_sync.mark_uploaded({name: hashes[name] for name in stats.completed})
+            print(f"Uploaded {stats.files} label files, skipped {skipped} unchanged, {stats.failed} failed")
+
+    def cancel_transfer(self):
+        job = self.transfers.current
+        if job is not None:
+            job.cancel()
+            self.transferLabel.config(text=f"Cancelling {job.name}...")
+
+    def update_transfer_panel(self):
+        job = self.transfers.current
+        pending = self.transfers.pending()
+        if job is not None:
+            queued = f" (+{len(pending)} queued)" if pending else ""
+            self.transferLabel.config(text=f"{job.name}{queued}")
+            self.transferProgress['value'] = job.stats.fraction() * 100
+            self.transferStatsLabel.config(text=job.stats.progress_string())
+            self.transferCancelButton.config(state='normal')
+            if job.batch is not None:
+                self.show_downloaded_images(job)
+        else:
+            last = self.transfers.last
+            self.transferLabel.config(text=f"{last.name}: {last.state}" if last else "No transfers")
+            self.transferProgress['value'] = last.stats.fraction() * 100 if last else 0
+            self.transferStatsLabel.config(text=str(last.stats) if last else "")
+            self.transferCancelButton.config(state='disabled')
+
+        self.rootPanel.after(TRANSFER_PANEL_MS, self.update_transfer_panel)
+
+    def get_downloaded_image_check(self, job):
+        # an image of a downloading batch is shown once its label, if the batch has one, is on disk as well,
+        # labels list after the images and may come in an archive, so nothing is shown before all of that is known
+        stats = job.stats
+        if stats.finished is not None:
+            return lambda name: True
+
+        with stats.lock:
+            listing_done = stats.listingDone
+            pending = set(stats.pending)
+
+        if not listing_done or any(ARCHIVE_PATTERN.match(os.path.basename(name)) for name in pending):
+            return lambda name: False
+
+        labels_prefix = f"batches/{os.path.basename(job.batch)}/labels/"
+        return lambda name: f"{labels_prefix}{name}.txt" not in pending
+
+    def show_downloaded_images(self, job):
+        # images of the open batch become navigable as soon as they and their labels are on disk
+        if job.batch != self.currentBatchDir:
+            selected = self.get_selected_batch()
+            if not self.currentBatchDir and selected and os.path.join(self.batchDir, selected) == job.batch and os.path.isdir(job.batch):
+                self.load_batch_dir(job.batch)
+
+            return
+
+        ready = self.get_downloaded_image_check(job)
+
+        seen_job, seen = self.transferSeen
+        if seen_job is not job:
+            seen = 0
+            self.heldImages = []
+
+        completed = job.stats.completed[seen:]
+        self.transferSeen = (job, seen + len(completed))
+
+        prefix = f"batches/{os.path.basename(job.batch)}/"
+        suffix = f".{self.fileNameExt}"
+        self.heldImages.extend(name[len(prefix):-len(suffix)] for name in completed if name.startswith(prefix) and name.endswith(suffix) and '/' not in name[len(prefix):])
+        names = [name for name in self.heldImages if ready(name)]
+        if names:
+            released = set(names)
+            self.heldImages = [name for name in self.heldImages if name not in released]
+            self.add_images(names)
+
+    def add_images(self, names):
+        known = set(self.imageList)
+        new_images = [name for name in names if name not in known]
+        if not new_images:
+            return
+
+        self.imageList.extend(new_images)
+        self.total = len(self.imageList)
+        if self.cur == 0:
+            self.cur = 1
+            self.load_image()
+            self.start_preannotation()
+        else:
+            self.progLabel.config(text=f"{self.cur}/{self.total}")
+
+    def load_dir(self, directory, ready=None):
+        # ready leaves out images of a batch that is still downloading whose label is not there yet
         self.rootPanel.focus()
 
         if not directory:
@@ -621,10 +3470,18 @@ class LabelTool:
         if not os.path.isdir(self.labelsDir):
             os.makedirs(self.labelsDir, exist_ok=True)
 
-        filelist = glob.glob(os.path.join(self.currentBatchDir, f"*.{self.fileNameExt}"))
-        filelist = [file.split("\\")[-1] for file in filelist]  # in form of filename
-        filelist = [os.path.splitext(file)[0] for file in filelist]  # remove extension
-        self.imageList = filelist.copy()
+        self.labelSync = LabelSyncState(self.currentBatchDir)
+        self.diskCache.touch(f"batches/{os.path.basename(directory)}")
+
+        # the index only reads what changed since the batch was last open, image sizes follow in the background
+        self.batchIndex = BatchIndex(self.currentBatchDir, self.fileNameExt)
+        self.batchIndex.refresh()
+        threading.Thread(target=self.batchIndex.fill_sizes, daemon=True).start()
+        self.imageList = self.batchIndex.names()
+        if ready is not None:
+            self.imageList = [name for name in self.imageList if ready(name)]
+
+        self.update_stats()
 
         if len(self.imageList) == 0:
             print('No .jpg images found in the specified dir!')
@@ -637,22 +3494,30 @@ class LabelTool:
         # Load a model
 
         self.load_image()
+        self.start_preannotation()
 
         self.annotationsList.focus_set()
 
+    @timed('load_image')
     def load_image(self):
-        self.selectedBbox = -1
+        if self.streamer is not None:
+            self.stream_neighbours()
+            if not self.streamer.is_fetched(self.imageList[self.cur - 1]):
+                self.show_fetching()
+                return
+
+        self.waitingFor = None
         self.tkimg = [0, 0, 0]
 
         # load image
         self.imgRootName = self.imageList[self.cur - 1]
         img_file_path = os.path.join(self.currentBatchDir, f"{self.imgRootName}.{self.fileNameExt}")
         self.tkimg = self.load_img_from_disk(img_file_path)
-        img_width = max(self.tkimg.width() * ZOOM_RATIO, 10)
-        img_height = max(self.tkimg.height() * ZOOM_RATIO, 10)
-        self.tkimg = self.tkimg._PhotoImage__photo.zoom(ZOOM_RATIO)
+        img_width = max(self.tkimg.width(), 10)
+        img_height = max(self.tkimg.height(), 10)
+        self.prefetch_neighbours()
         self.mainPanel.config(width=img_width, height=img_height)
-        self.mainPanel.create_image(0, 0, image=self.tkimg, anchor=N + W)
+        self.mainPanel.itemconfig(self.backgroundId, image=self.tkimg)
 
         self.progLabel.config(text=f"{self.cur}/{self.total}")
         self.lblFilename.config(text=f"Filename: {self.imgRootName}")
@@ -661,56 +3526,97 @@ class LabelTool:
 
         # load labels
         xyxy_list = self.get_boxes_from_file()
-        print(f'Loaded labels from file: "{xyxy_list}"')
+        print(f'Loaded {len(xyxy_list)} labels from file' if xyxy_list is not None else 'No label file')
         should_save = xyxy_list is None
         if should_save:
             print(f'Inferencing using YOLO...')
             xyxy_list = self.get_predictions_from_yolo()
-            print(f'Loaded labels using YOLO: "{xyxy_list}"')
+            print(f'Loaded {len(xyxy_list)} labels using YOLO' if xyxy_list is not None else 'No model loaded')
 
         if xyxy_list is not None:
-            first = True
             for x1, y1, x2, y2, classIndex, selected in xyxy_list:
-                box_string = self.get_bbox_string(x1, y1, x2, y2, classIndex, True if first else selected)
-                self.annotationsList.insert(END, box_string)
-                self.annotationsList.itemconfig(END, {'fg': COLORS[classIndex]})
-                if first:
-                    self.selectedBbox = 0
+                self.add_box(x1, y1, x2, y2, classIndex)
 
-                first = False
+            if len(self.boxStore) > 0:
+                self.select_box(0)
 
             if should_save:
                 self.save_image()
 
-    def get_bbox_string(self, x1, y1, x2, y2, class_index, selected):
-        bbox_id = self.create_bbox(x1, y1, x2, y2, COLORS[class_index], selected)
-        box_string = f"{{'class': '{self.classesList[class_index]}', 'x1': {x1}, 'y1': {y1}, 'x2': {x2}, 'y2': {y2}, 'id': {bbox_id}, 'selected': {selected}}}"
-        return box_string
+    @timed('add_box')
+    def add_box(self, x1, y1, x2, y2, class_index):
+        index = self.boxStore.add(x1, y1, x2, y2, class_index)
+        self.render_box(index)
+        self.mainPanel.tag_raise('overlay')
+        self.annotationsList.insert(END, self.get_bbox_string(self.boxStore[index]))
+        self.annotationsList.itemconfig(index, {'fg': get_color(class_index)})
+        return index
+
+    def get_bbox_string(self, box):
+        return f"{{'class': '{self.classesList.get(box.classIndex, box.classIndex)}', 'x1': {box.x1}, 'y1': {box.y1}, 'x2': {box.x2}, 'y2': {box.y2}}}"
+
+    def refresh_box_row(self, index):
+        box = self.boxStore[index]
+        self.annotationsList.delete(index)
+        self.annotationsList.insert(index, self.get_bbox_string(box))
+        self.annotationsList.itemconfig(index, {'fg': get_color(box.classIndex)})
+        if index == self.boxStore.selected:
+            self.annotationsList.selection_set(index)
+
+    @timed('select_box')
+    def select_box(self, index):
+        if not 0 <= index < len(self.boxStore):
+            return
+
+        previous = self.boxStore.selected
+        self.boxStore.selected = index
+        self.annotationsList.selection_clear(0, END)
+        self.annotationsList.selection_set(index)
+        self.annotationsList.activate(index)
+        self.annotationsList.see(index)
+
+        # only the box losing and the box gaining the selection change on the canvas
+        if 0 <= previous < len(self.boxStore) and previous != index:
+            self.render_box(previous)
+        self.render_box(index)
+
+    def has_label_file(self, name):
+        label_path = os.path.join(self.labelsDir, f"{name}.txt")
+        return self.labelWriter.pending_content(label_path) is not None or os.path.exists(label_path)
 
+    @timed('read_labels')
     def get_boxes_from_file(self):
         annotation_file_path, img_width, img_height = self.get_annotations_metadata()
         results = []
-        if os.path.exists(annotation_file_path):
+        # an edit that is still on its way to disk is newer than the file
+        content = self.labelWriter.pending_content(annotation_file_path)
+        if content is None and os.path.exists(annotation_file_path):
             with open(annotation_file_path) as file:
-                for i, line in enumerate(file):
-                    tmp = line.split()
-                    class_index = int(tmp[0])
-                    cx = int(float(tmp[1]) * img_width)
-                    cy = int(float(tmp[2]) * img_height)
-                    hw = int(float(tmp[3]) * img_width / 2)
-                    hh = int(float(tmp[4]) * img_height / 2)
-                    x1 = cx - hw
-                    y1 = cy - hh
-                    x2 = cx + hw
-                    y2 = cy + hh
-                    results.append((x1, y1, x2, y2, class_index, False))
+                content = file.read()
 
             file.close()
-        else:
+            self.labelWriter.remember(annotation_file_path, content)
+
+        if content is None:
+            self.labelWriter.remember(annotation_file_path, None)
             return None
 
+        for line in content.splitlines():
+            tmp = line.split()
+            class_index = int(tmp[0])
+            cx = int(float(tmp[1]) * img_width)
+            cy = int(float(tmp[2]) * img_height)
+            hw = int(float(tmp[3]) * img_width / 2)
+            hh = int(float(tmp[4]) * img_height / 2)
+            x1 = cx - hw
+            y1 = cy - hh
+            x2 = cx + hw
+            y2 = cy + hh
+            results.append((x1, y1, x2, y2, class_index, False))
+
         return results
 
+    @timed('predictions')
     def get_predictions_from_yolo(self):
         if self.model is None:
             return None
@@ -719,49 +3625,118 @@ class LabelTool:
         if not os.path.exists(rgb_img_file_path) or os.path.isdir(rgb_img_file_path):
             return None
 
+        # usually already computed by the pre-annotator, otherwise predict just this image
+        image_hash = self.get_image_hash(rgb_img_file_path)
+        boxes = self.predictionCache.get(image_hash)
+        if boxes is None:
+            with self.modelLock:
+                boxes = predict_boxes(self.model, [rgb_img_file_path])[0]
+
+            self.predictionCache.put(image_hash, boxes)
+            self.predictionCache.save()
+
+        _, img_width, img_height = self.get_annotations_metadata()
         results = []
-        predictions = self.model(rgb_img_file_path)  # predict on an image
-        for result in predictions:
-            # probs = result.probs  # Probs object for classification outputs
-            for box in result.boxes:
-                class_index = int(box.cls.item())
-                if class_index in self.yolo_prediction_classes.keys():
-                    class_name = self.yolo_prediction_classes[class_index]
-                    index = self.get_key_from_value(self.classesList, class_name)
-
-                    # safety mechanism not to crash if yolo gives higher class then target model supports
-                    if index not in self.classesList:
-                        index = 0
-
-                    for x1, y1, x2, y2 in box.xyxy:
-                        results.append((int(x1) * ZOOM_RATIO, int(y1) * ZOOM_RATIO, int(x2) * ZOOM_RATIO, int(y2) * ZOOM_RATIO, index, False))
+        for class_index, x1, y1, x2, y2 in boxes:
+            index = map_prediction_class(class_index, self.yolo_prediction_classes, self.classIndexes)
+            if index is not None:
+                results.append((int(x1 * img_width), int(y1 * img_height), int(x2 * img_width), int(y2 * img_height), index, False))
 
         return results
 
     def load_img_from_disk(self, full_file_path):
-        loaded_img = Image.open(full_file_path)
-        size = loaded_img.size
-        img_factor = max(size[0] / 1000, size[1] / 1000., 1.)
-        loaded_img = loaded_img.resize((int(size[0] / img_factor), int(size[1] / img_factor)))
-        return ImageTk.PhotoImage(loaded_img)
+        from PIL import ImageTk
+
+        with timings.span('prefetch_get'):
+            image = self.prefetcher.get(full_file_path)
+
+        with timings.span('photo_image'):
+            return ImageTk.PhotoImage(image)
 
+    def prefetch_neighbours(self):
+        # the direction the annotator is moving in comes first
+        paths = []
+        for distance in range(1, PREFETCH_RADIUS + 1):
+            for step in (self.navigationStep, -self.navigationStep):
+                index = self.cur - 1 + step * distance
+                if 0 <= index < len(self.imageList) and (self.streamer is None or self.streamer.is_fetched(self.imageList[index])):
+                    paths.append(os.path.join(self.currentBatchDir, f"{self.imageList[index]}.{self.fileNameExt}"))
+
+        self.prefetcher.prefetch(paths)
+
+    def schedule_load_image(self):
+        # key-repeat queues up navigation events, only the image they end on is loaded
+        if self.pendingLoad is None:
+            self.pendingLoad = self.rootPanel.after_idle(self.run_pending_load)
+
+    def run_pending_load(self):
+        self.pendingLoad = None
+        if self.imageList and self.imgRootName != self.imageList[self.cur - 1]:
+            self.load_image()
+
+    @timed('save_image')
     def save_image(self):
         if self.imgRootName == '':
             return
 
         annotation_file_path, img_width, img_height = self.get_annotations_metadata()
-        annotations = self.annotationsList.get(0, END)
-        with open(annotation_file_path, 'w') as file:
-            for annotationListItem in annotations:
-                annotation = ast.literal_eval(annotationListItem)
-                class_ = self.get_key_from_value(self.classesList, annotation['class'])
-                center_x = (annotation['x1'] + annotation['x2']) / 2. / img_width
-                center_y = (annotation['y1'] + annotation['y2']) / 2. / img_height
-                height = abs(annotation['x1'] - annotation['x2']) * 1. / img_width
-                width = abs(annotation['y1'] - annotation['y2']) * 1. / img_height
-                file.write(f'{class_} {center_x} {center_y} {height} {width}\n')
+        lines = []
+        for box in self.boxStore:
+            lines.append(format_label_line(box.classIndex, box.x1 / img_width, box.y1 / img_height, box.x2 / img_width, box.y2 / img_height))
 
-        file.close()
+        label_sync, batch_index, name, classes = self.labelSync, self.batchIndex, self.imgRootName, [box.classIndex for box in self.boxStore]
+
+        def on_written(path):
+            # on the writer thread, the sync state and the index are both safe to update from there
+            if label_sync is not None:
+                label_sync.record_saved(os.path.basename(path))
+
+            if batch_index is not None:
+                batch_index.set_label(name, classes, os.stat(path).st_mtime_ns)
+                self.run_on_ui(self.update_stats)
+
+        self.labelWriter.write(annotation_file_path, ''.join(lines), on_written)
+
+    def update_stats(self):
+        if self.batchIndex is None:
+            self.statsLabel.config(text='')
+            return
+
+        stats = self.batchIndex.stats()
+        classes = ', '.join(f"{self.classesList.get(class_index, class_index)}: {count}" for class_index, count in stats['classes'].items())
+        self.statsLabel.config(text=f"Labeled {stats['labeled']}/{max(stats['images'], self.total)}, {stats['boxes']} boxes\n{classes}")
+
+    def get_labeled_names(self):
+        labeled = self.batchIndex.labeled_names()
+        # saved, but not written yet
+        labeled.update(os.path.basename(path)[:-len('.txt')] for path in self.labelWriter.pending_paths() if os.path.dirname(path) == self.labelsDir)
+        if self.streamer is not None:
+            # images not fetched yet count as labeled when the server has a label for them
+            prefix = f"{self.streamer.folder}/labels/"
+            labeled.update(name[len(prefix):-len('.txt')] for name in list(self.streamer.blobs) if name.startswith(prefix) and name.endswith('.txt'))
+
+        return labeled
+
+    def next_unlabeled(self, event=None):
+        if self.batchIndex is not None:
+            self.jump_to_next(self.get_labeled_names(), False, "No unlabeled images left in this batch")
+
+    def next_with_class(self, event=None):
+        if self.batchIndex is not None:
+            class_index = self.classIndexes.get(self.currentLabelClass, 0)
+            self.jump_to_next(self.batchIndex.names_with_class(class_index), True, f"No other images with {self.currentLabelClass}")
+
+    def jump_to_next(self, names, wanted, not_found):
+        # searches forward from the current image and wraps around
+        for offset in range(1, len(self.imageList) + 1):
+            index = (self.cur - 1 + offset) % len(self.imageList)
+            if (self.imageList[index] in names) == wanted and index != self.cur - 1:
+                self.save_image()
+                self.cur = index + 1
+                self.load_image()
+                return
+
+        self.set_status(not_found)
 
     def get_annotations_metadata(self):
         annotation_file_name = self.imgRootName
@@ -770,29 +3745,20 @@ class LabelTool:
         return annotation_file_path, img_width, img_height
 
     def mouse_click(self, event):
+        if not self.imgRootName:
+            return
+
         if self.STATE == {}:
             self.STATE['class'], self.STATE['x1'], self.STATE['y1'] = self.currentLabelClass, event.x, event.y
+            self.mainPanel.coords(self.curBBoxId, event.x, event.y, event.x, event.y)
+            self.mainPanel.itemconfig(self.curBBoxId, outline=get_color(self.classIndexes.get(self.currentLabelClass, 0)), state='normal')
         else:
             self.STATE['x2'], self.STATE['y2'] = event.x, event.y
-            bbox_id = self.create_bbox(self.STATE['x1'], self.STATE['y1'], self.STATE['x2'], self.STATE['y2'], COLORS[self.get_key_from_value(self.classesList, self.STATE['class'])], True)
-            self.STATE['id'], self.STATE['selected'] = bbox_id, True  # attributes in order
-
-            # For other boxes, set the 'selected' attribute to False
-            idx = 0
-            for item in self.annotationsList.get(0, END):
-                bbox = ast.literal_eval(item)
-                bbox['selected'] = False
-                self.annotationsList.delete(idx)
-                self.annotationsList.insert(0, str(bbox))
-                idx += 1
-
-            self.annotationsList.insert(END, str(self.STATE))
-            self.STATE = {}
-
-            self.selectedBbox = self.annotationsList.size() - 1
-            self.annotationsList.focus_set()
+            index = self.add_box(self.STATE['x1'], self.STATE['y1'], self.STATE['x2'], self.STATE['y2'], self.classIndexes.get(self.STATE['class'], 0))
+            self.cancel_bbox()
 
-            self.render_boxes()
+            self.annotationsList.focus_set()
+            self.select_box(index)
 
     def toggle_next_bbox_after_class(self):
         self.config['next_box_after_class_set'] = not self.config['next_box_after_class_set']
@@ -807,19 +3773,25 @@ class LabelTool:
         return bbox_id
 
     def mouse_move(self, event):
-        self.disp.config(text=f'x: {event.x}, y: {event.y}')
+        # high polling rate mice send far more events than can be drawn, only the latest position is kept
+        self.pointer = (event.x, event.y)
+        if self.pendingPointerDraw is None:
+            self.pendingPointerDraw = self.rootPanel.after(POINTER_REFRESH_MS, self.draw_pointer)
+
+    def draw_pointer(self):
+        self.pendingPointerDraw = None
+        x, y = self.pointer
+        self.disp.config(text=f'x: {x}, y: {y}')
         if self.tkimg:
-            if self.horizontalLine:
-                self.mainPanel.delete(self.horizontalLine)
-            self.horizontalLine = self.mainPanel.create_line(0, event.y, self.tkimg.width(), event.y, width=2)
-            if self.verticalLine:
-                self.mainPanel.delete(self.verticalLine)
-            self.verticalLine = self.mainPanel.create_line(event.x, 0, event.x, self.tkimg.height(), width=2)
+            self.mainPanel.coords(self.horizontalLine, 0, y, self.tkimg.width(), y)
+            self.mainPanel.coords(self.verticalLine, x, 0, x, self.tkimg.height())
+            if not self.crosshairShown:
+                self.mainPanel.itemconfig(self.horizontalLine, state='normal')
+                self.mainPanel.itemconfig(self.verticalLine, state='normal')
+                self.crosshairShown = True
 
         if self.STATE != {}:
-            if self.curBBoxId:
-                self.mainPanel.delete(self.curBBoxId)
-            self.curBBoxId = self.mainPanel.create_rectangle(self.STATE['x1'], self.STATE['y1'], event.x, event.y, width=2, outline=COLORS[self.get_key_from_value(self.classesList, self.currentLabelClass)])
+            self.mainPanel.coords(self.curBBoxId, self.STATE['x1'], self.STATE['y1'], x, y)
 
     def class_on_create(self, event=None):
         index = self.classCandidate.current()
@@ -829,31 +3801,26 @@ class LabelTool:
         self.currentLabelClass = self.classesList[index]
 
     def cancel_bbox(self, event=None):
-        if self.curBBoxId:
-            self.mainPanel.delete(self.curBBoxId)
+        self.mainPanel.itemconfig(self.curBBoxId, state='hidden')
         self.STATE = {}
 
     def del_bbox(self, event=None):
-        idx = 0
-        for item in self.annotationsList.get(0, END):
-            bbox = ast.literal_eval(item)
-            is_selected = bbox.get('selected', False)
-            if is_selected:
-                self.mainPanel.delete(bbox['id'])
-                self.annotationsList.delete(idx)
-            idx += 1
+        index = self.boxStore.selected
+        if self.boxStore.selected_box() is None:
+            return
 
-        if self.selectedBbox >= self.annotationsList.size():
-            self.selectedBbox = 0
+        box = self.boxStore.remove(index)
+        self.mainPanel.delete(box.canvasId)
+        self.annotationsList.delete(index)
 
-        self.on_listbox_select()
-        self.render_boxes()
+        if len(self.boxStore) > 0:
+            self.select_box(self.boxStore.selected)
 
     def del_all_bboxes(self, event=None):
-        num_elements = len(self.annotationsList.get(0, END))
-        self.annotationsList.delete(0, num_elements - 1)
-        self.selectedBbox = 0
-        self.render_boxes()
+        for box in self.boxStore.clear():
+            self.mainPanel.delete(box.canvasId)
+
+        self.annotationsList.delete(0, END)
 
     def prev_image(self, event=None):
         if len(self.imageList) < 1:
@@ -862,7 +3829,8 @@ class LabelTool:
         self.save_image()
         if self.cur > 1:
             self.cur -= 1
-            self.load_image()
+            self.navigationStep = -1
+            self.schedule_load_image()
 
     def next_image(self, event=None):
         if len(self.imageList) < 1:
@@ -871,7 +3839,8 @@ class LabelTool:
         self.save_image()
         if self.cur < self.total:
             self.cur += 1
-            self.load_image()
+            self.navigationStep = 1
+            self.schedule_load_image()
             self.cancel_bbox()
 
     def goto_image(self):
@@ -884,109 +3853,84 @@ class LabelTool:
         self.annotationsList.focus_set()
 
     def set_class(self, key):
-        self.mainPanel.create_image(0, 0, image=self.tkimg, anchor=N + W)
-        idx = 0
-        for item in self.annotationsList.get(0, END):
-            bbox = ast.literal_eval(item)
-            if bbox['selected'] is True:
-                try:
-                    target_class_index = int(key.keysym) - 1
-                    target_class = self.classesList[target_class_index]
-                except (IndexError, ValueError) as key:
-                    print("Error:", key)
-                    return
-                bbox_id = bbox.get('id', 0)
-                if bbox_id > 0:
-                    bbox['class'] = target_class
-                    self.annotationsList.delete(idx)
-                    self.annotationsList.insert(idx, bbox)
-                    self.annotationsList.itemconfig(idx, {'fg': COLORS[target_class_index]})
-            idx += 1
+        box = self.boxStore.selected_box()
+        if box is not None:
+            try:
+                target_class_index = int(key.keysym) - 1
+            except ValueError as key:
+                print("Error:", key)
+                return
+
+            if target_class_index not in self.classesList:
+                print("Error:", f"no class {key.keysym}")
+                return
+
+            box.classIndex = target_class_index
+            self.refresh_box_row(self.boxStore.selected)
+            self.render_box(self.boxStore.selected)
 
         if self.config['next_box_after_class_set']:
             self.arrow_down()
 
-        self.render_boxes()
-
     def arrow_up(self, event=None):
-        self.selectedBbox -= 1
-        if self.selectedBbox < 0:
-            self.selectedBbox = self.annotationsList.size() - 1
-        self.on_listbox_select()
+        if len(self.boxStore) < 1:
+            return
+
+        index = self.boxStore.selected - 1
+        if index < 0:
+            index = len(self.boxStore) - 1
+        self.select_box(index)
 
     def arrow_down(self, event=None):
-        self.selectedBbox += 1
-        if self.selectedBbox >= self.annotationsList.size():
-            self.selectedBbox = 0
-        self.on_listbox_select()
+        if len(self.boxStore) < 1:
+            return
+
+        index = self.boxStore.selected + 1
+        if index >= len(self.boxStore):
+            index = 0
+        self.select_box(index)
 
     def on_listbox_select(self, event=None):
-        if self.annotationsList.size() < 1:
+        if len(self.boxStore) < 1:
             return
 
-        # Get the selected item's index
-        selected_indices = self.annotationsList.curselection()  # arrows return empty indices for some reason, even though the item gets underlined which means its active
+        # arrows return empty indices for some reason, even though the item gets underlined which means its active
+        selected_indices = self.annotationsList.curselection()
         if selected_indices:
-            idx = self.selectedBbox = selected_indices[0]
+            self.select_box(selected_indices[0])
         else:
-            idx = self.selectedBbox
+            self.select_box(max(self.boxStore.selected, 0))
+
+    @timed('render_box')
+    def render_box(self, index):
+        box = self.boxStore[index]
+        selected = index == self.boxStore.selected
+        if box.canvasId is None:
+            box.canvasId = self.create_bbox(box.x1, box.y1, box.x2, box.y2, color=get_color(box.classIndex), selected=selected)
+        else:
+            self.mainPanel.coords(box.canvasId, box.x1, box.y1, box.x2, box.y2)
+            self.mainPanel.itemconfig(box.canvasId, outline=get_color(box.classIndex), width=2 if selected else 1)
 
-        # Retrieve the current string value from the selected item
-        selected_str = self.annotationsList.get(idx)
-
-        try:
-            # Safely evaluate the string as a Python literal expression
-            selected_dict = ast.literal_eval(selected_str)
-            selected_class = self.get_key_from_value(self.classesList, selected_dict['class'])
-
-            # Update the dictionary to include 'selected': true
-            selected_dict['selected'] = True
-
-            # Convert the updated dictionary back to a string
-            updated_str = str(selected_dict)
-
-            # Set the updated string as the value of the selected item
-            self.annotationsList.delete(idx)
-            self.annotationsList.insert(idx, updated_str)
-            self.annotationsList.itemconfig(idx, {'fg': COLORS[selected_class]})
-
-            # For other items, set the 'selected' attribute to False
-            for i in range(self.annotationsList.size()):
-                if i != idx:
-                    other_str = self.annotationsList.get(i)
-                    other_dict = ast.literal_eval(other_str)
-                    other_class = self.get_key_from_value(self.classesList, other_dict['class'])
-                    if 'selected' in other_dict:
-                        other_dict['selected'] = False
-
-                    self.annotationsList.delete(i)
-                    self.annotationsList.insert(i, str(other_dict))
-                    self.annotationsList.itemconfig(i, {'fg': COLORS[other_class]})
-
-            self.render_boxes()
-        except (ValueError, SyntaxError) as exception:
-            print("Error:", exception)
-
-    def render_boxes(self):
-        self.mainPanel.create_image(0, 0, image=self.tkimg, anchor=N + W)
-        for item in self.annotationsList.get(0, END):
-            bbox = ast.literal_eval(item)
-            self.mainPanel.delete(bbox['id'])
-            current_class = self.get_key_from_value(self.classesList, bbox['class'])
-            self.create_bbox(bbox['x1'], bbox['y1'], bbox['x2'], bbox['y2'], color=COLORS[current_class], selected=bbox['selected'])
-
-    def get_key_from_value(self, dictionary, search_value):
-        # Iterate over all items in the dictionary
-        for key, value in dictionary.items():
-            # Check if the current value matches the search value
-            if value == search_value:
-                return key  # Return the key corresponding to the value
-        return None  # Return None if the value is not found in the dictionary
+    def canvas_item_count(self):
+        # stays at boxes + background + 2 crosshair lines + rubber band, no matter how long the session runs
+        return len(self.mainPanel.find_all())
 
 
 if __name__ == '__main__':
+    # spans are recorded from the start, to see where the first image goes
+    timings.enabled = '--timings' in sys.argv or os.environ.get('AZ_TRAINER_TIMINGS', '') not in ('', '0')
+    # a data dir other than the one next to the repo, e.g. the throwaway one of benchmarks/bench_startup.py
+    data_dir = sys.argv[sys.argv.index('--data-dir') + 1] if '--data-dir' in sys.argv else None
     root = Tk()
-    tool = LabelTool(root)
+    tool = LabelTool(root, data_dir)
     root.resizable(width=True, height=True)
     root.focus_force()
+
+    # used by benchmarks/bench_startup.py to track time-to-first-window
+    if '--startup-benchmark' in sys.argv:
+        root.update()
+        print(f"first window after {(time.perf_counter() - PROCESS_STARTED) * 1000:.0f} ms", flush=True)
+        root.destroy()
+        sys.exit(0)
+
     root.mainloop()